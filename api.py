@@ -1,8 +1,19 @@
 from flask import Flask, request, jsonify, render_template
+from markupsafe import Markup
 from flask_cors import CORS, cross_origin
 from models import PinballMachine, Player, Score
-from data_manager import load_data, save_data
-from time import sleep
+from data_manager import (load_data, save_data, start_reconcile, persistence_status, has_changes,
+                          catch_up, write_transaction, start_sync, ensure_sync, storage_version)
+from score_index import normalize_date
+from state import StateManager
+from validation import SCORE_VALIDATION, check_points
+from bulk_scores import (FORMATS, CONTENT_TYPES, BulkFormatError, ScoreImport, detect_format,
+                         read_rows, parse_scores, export_scores)
+from http_cache import DataVersion, conditional, gzip_response
+from serialization import json_response
+from events import EventBus
+from matching import suggest_matches
+from metrics import metrics, instrument
 
 import datetime
 import os
@@ -10,8 +21,88 @@ import os
 
 
 app = Flask(__name__)
-
-data = load_data()
+instrument(app)
+app.after_request(gzip_response)
+
+state = StateManager(load_data(), exclusive=lambda: write_transaction(apply_changes, reload_data))
+data_version = DataVersion()
+events = EventBus()
+# The data and indexes of the copy the current request works with (see StateManager)
+data = state.proxy('data')
+leaderboard = state.proxy('leaderboard')
+player_stats = state.proxy('player_stats')
+score_index = state.proxy('score_index')
+score_statistics = state.proxy('score_statistics')
+daily = state.proxy('daily')
+
+metrics.set('aixplay_scores', lambda: len(data['scores']))
+metrics.set('aixplay_players', lambda: len(data['players']))
+metrics.set('aixplay_pinball_machines', lambda: len(data['pinball_machines']))
+metrics.set('aixplay_data_version', lambda: data_version.value)
+metrics.set('aixplay_storage_pending_mutations', lambda: persistence_status().get('pending_mutations', 0))
+
+
+def advance_version(mutations=1):
+    # The persisted position where the storage backend has one (the same in every worker
+    # holding the same data), otherwise a count of the mutations of this process
+    version = storage_version()
+    if version is None:
+        data_version.bump(mutations)
+    else:
+        data_version.sync(version)
+
+def reload_data(new_data):
+    # Newer data from the storage backend
+    with state.write(exclusive=False):
+        state.reload(new_data)
+        advance_version()
+    events.publish({'op': 'reload', 'version': data_version.value})
+
+def apply_changes(mutations):
+    # Mutations another worker process wrote (STORAGE_BACKEND=sqlite), applied as deltas
+    for mutation in mutations:
+        state.apply(mutation)
+    advance_version(len(mutations))
+    for mutation in mutations:
+        events.publish(dict(change_event(mutation), version=data_version.value))
+
+def sync_workers():
+    if has_changes():
+        with state.write(exclusive=False):
+            catch_up(apply_changes, reload_data)
+
+def commit(mutation):
+    # Every mutating route ends here: applies and persists the change, then invalidates the ETags
+    # of the read endpoints (only after publishing, so an ETag never belongs to older data; with
+    # a shared backend the new version is the position the change was persisted at) and pushes
+    # it to the /events subscribers
+    result = state.apply(mutation)
+    save_data(state.published.data, mutation)
+    advance_version()
+    events.publish(dict(change_event(mutation), version=data_version.value))
+    return result
+
+def cached_json(key, compute):
+    # Encoded once per data version, view and ?fields=/?compact= (see serialization.json_response)
+    return json_response(state.current(), key, compute)
+
+def change_event(mutation):
+    # An import carries thousands of scores, the subscribers only need to know which machines changed
+    if mutation['op'] == 'add_scores':
+        return {'op': 'add_scores', 'machines': sorted({score['pinball_abbreviation'] for score in mutation['scores']})}
+    return mutation
+
+# With a shared backend the version starts at the position of the loaded data
+advance_version(0)
+# The reload has to happen under the writers' lock, together with merging the changes made meanwhile
+start_reconcile(reload_data, state.write)
+start_sync(sync_workers)
+
+@app.before_request
+def sync_before_request():
+    # In multi-worker mode every request sees what the other workers wrote before it
+    ensure_sync()
+    sync_workers()
 
 @app.route('/')
 def index():
@@ -22,70 +113,23 @@ def ifpa():
     return render_template('ifpa.html')
 
 @app.route('/score-overview/<pinball>/<player>')
+@conditional(data_version)
+@state.reader
 def score_overview(pinball, player):
-    # Filter scores for the selected pinball machine
-    pinball_scores = [score for score in data['scores'] if score['pinball_abbreviation'] == pinball]
-
-    # If no scores found for the pinball, return empty data
-    if not pinball_scores:
-        return jsonify({'minScore': None, 'maxScore': None, 'playerScore': None})
-
-    # Determine the highest score per player
-    highest_scores_per_player = {}
-    for score in pinball_scores:
-        player_abbr = score['player_abbreviation']
-        if player_abbr not in highest_scores_per_player or highest_scores_per_player[player_abbr] < score['points']:
-            highest_scores_per_player[player_abbr] = score['points']
-
-    # Create a list of highest scores for the pinball machine
-    highest_scores = list(highest_scores_per_player.values())
-
-    # Sort the scores in descending order
-    highest_scores.sort(reverse=True)
-
-    # Determine min_score based on the number of scores
-    min_score = highest_scores[14] if len(highest_scores) > 15 else min(highest_scores)
-
-    # Get the maximum score for the pinball machine
-    max_score = max(highest_scores)
-
-    # Determine the latest score for the requested player
-    player_latest_score = highest_scores_per_player.get(player, None)
+    # Answered from the machine's sorted leaderboard, no scan over the scores
+    return jsonify(leaderboard.overview(pinball, player))
 
-    return jsonify({
-        'minScore': min_score,
-        'maxScore': max_score,
-        'playerScore': player_latest_score
-    })
+@app.route('/preview-rank/<pinball>/<player>/<int:points>')
+@conditional(data_version)
+@state.reader
+def preview_rank(pinball, player, points):
+    # Rank and ranking points a score would get, for the score entry page while typing
+    return jsonify(leaderboard.preview(pinball, player, points))
 
 
 
-def is_score_valid(pinball_abbreviation, new_score, scores_data):
-    """
-    Validates a new score for a specific pinball machine.
-
-    Args:
-    pinball_abbreviation (str): Abbreviation of the pinball machine.
-    new_score (int): The new score to be validated.
-    scores_data (list of dict): List of scores data dictionaries.
-
-    Returns:
-    bool: True if the score is valid, False otherwise.
-    """
-    # Filter scores for the specific pinball machine
-    filtered_scores = [score['points'] for score in scores_data if score['pinball_abbreviation'] == pinball_abbreviation]
-
-    # Ensure there are at least 5 scores to compare with
-    if len(filtered_scores) < 5:
-        return True  # Not enough data to validate
-
-    # Calculate the average of the existing scores
-    avg_score = sum(filtered_scores) / len(filtered_scores)
-    print("avg"+str(avg_score))
-    # Check if the new score deviates by more than 50% from the average
-    return new_score <= 1.5 * avg_score
-
 @app.route('/validate_score', methods=['POST'])
+@state.reader
 def validate_score():
     # Daten aus der POST-Anfrage extrahieren
     body = request.json
@@ -96,42 +140,51 @@ def validate_score():
     if not all([pinball_abbreviation, new_score]):
         return jsonify({'error': 'Missing data'}), 400
 
-    # Filtern Sie die vorhandenen Scores und überprüfen Sie, ob sie die erforderlichen Schlüssel enthalten
-    filtered_scores = [score for score in data['scores']
-                       if 'pinball_abbreviation' in score and 'score' in score
-                       and score['pinball_abbreviation'] == pinball_abbreviation]
-
-    if not filtered_scores:
-        return jsonify({'error': 'No valid existing scores for given abbreviation'}), 404
-
-    # Ermitteln Sie den besten (höchsten) Score für die gegebene pinball_abbreviation
-    best_score = max(filtered_scores, key=lambda x: x['score'])['score']
-
-    # Berechnen Sie die Abweichung des neuen Scores vom besten Score
-    deviation = new_score - best_score
-
-    # Rufen Sie Ihre Validierungsfunktion mit der Abweichung auf
-    is_valid = is_score_valid(pinball_abbreviation, new_score, deviation)
-
-    # Rückgabe des Ergebnisses
-    return jsonify({'is_valid': is_valid})
+    # Plausibilität gegen die laufende Statistik der Maschine prüfen
+    try:
+        check_points(new_score)
+        return jsonify(score_statistics.check(pinball_abbreviation, new_score))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 
 @app.route('/admin')
 def score_admin():
-    # Laden Sie die notwendigen Daten
-    scores = data['scores']
-    players = {player['abbreviation']: player['name'] for player in data['players']}
-    pinballs = {machine['abbreviation']: machine['long_name'] for machine in data['pinball_machines']}
-    scores.sort(key=lambda x: datetime.datetime.strptime(x['date'], '%Y-%m-%d'), reverse=True)
+    # Die Scores lädt die Seite seitenweise über /admin/scores (static/admin.js)
+    return render_template('admin.html')
+
+@app.route('/admin/scores', methods=['GET'])
+@conditional(data_version)
+@state.reader
+def get_admin_scores():
+    # Neueste zuerst, filterbar: ?player=&machine=&from=YYYY-MM-DD&to=YYYY-MM-DD&offset=&limit=
+    player = request.args.get('player')
+    machine = request.args.get('machine')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if not all(is_valid_date(date) for date in (date_from, date_to) if date):
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+
+    if player or machine:
+        # Spieler und Maschinen haben wenige Scores, die werden gefiltert und einmal pro Version sortiert
+        scores = state.current().view(('admin_scores', player, machine, date_from, date_to),
+                                      lambda: filtered_scores_newest_first(player, machine, date_from, date_to))
+        total = len(scores)
+        scores = scores[offset:offset + limit] if limit is not None else scores[offset:]
+    else:
+        scores, total = score_index.newest_first(date_from, date_to, offset, limit)
 
     # Umwandeln der Scores in ein für das Frontend geeignetes Format
+    players = player_stats.players
+    pinballs = {machine['abbreviation']: machine['long_name'] for machine in data['pinball_machines']}
     scores_display = []
     for score in scores:
+        player_info = players.get(score['player_abbreviation'])
         scores_display.append({
-          #  'id': score['id'],  # Nehmen Sie an, dass jede Punktzahl eine eindeutige ID hat
-            'player': players.get(score['player_abbreviation'], 'unknown player'),
+            'player': player_info['name'] if player_info else 'unknown player',
             'pinball': pinballs.get(score['pinball_abbreviation'], 'Unknown machine'),
             'points': score['points'],
             'date': score['date'],
@@ -139,51 +192,68 @@ def score_admin():
             'pinball_abbreviation': score['pinball_abbreviation']
         })
 
-    return render_template('admin.html', scores=scores_display)
+    response = jsonify(scores_display)
+    response.headers['X-Total-Count'] = str(total)
+    return response, 200
+
+def filtered_scores_newest_first(player, machine, date_from, date_to):
+    scores = score_index.player(player) if player else score_index.machine(machine)
+    low = normalize_date(date_from) if date_from else None
+    high = normalize_date(date_to) if date_to else None
+    scores = [score for score in scores
+              if (not machine or score['pinball_abbreviation'] == machine)
+              and (low is None or normalize_date(score['date']) >= low)
+              and (high is None or normalize_date(score['date']) <= high)]
+    # Stabil sortiert, innerhalb eines Tages bleibt die Eingabereihenfolge
+    return sorted(scores, key=lambda score: normalize_date(score['date']), reverse=True)
 
 
 @app.route('/bigscreen')
+@conditional(data_version)
+@state.reader
 def bigscreen():
+    # Die Seite hängt nur von den Tabellen ab, beides wird einmal pro Datenversion gerendert
+    return state.current().view('bigscreen', lambda: render_template('bigscreen.html', tables=bigscreen_tables()))
+
+@app.route('/bigscreen/tables')
+@conditional(data_version)
+@state.reader
+def bigscreen_tables_fragment():
+    # Nur die Tabellen, zum Nachladen durch die Anzeige (static/bigscreen.js)
+    return bigscreen_tables()
+
+def bigscreen_tables():
+    return state.current().view('bigscreen_tables', render_bigscreen_tables)
+
+def render_bigscreen_tables():
     # Umwandeln der Spieler- und Pinball-Listen in Wörterbücher für einfachen Zugriff
     player_dict = {player['abbreviation']: player['name'] for player in data['players']}
     pinball_dict = {machine['abbreviation']: machine['long_name'] for machine in data['pinball_machines']}
 
-    # Berechnen der Anzahl der von jedem Spieler gespielten einzigartigen Maschinen
-    played_machines_per_player = {player['abbreviation']: set() for player in data['players']}
-    for score in data['scores']:
-        played_machines_per_player[score['player_abbreviation']].add(score['pinball_abbreviation'])
-
-    # Erstellen der Daten für die erste Tabelle (Spielerstatistiken)
-    players_table_data = [
-        {
-            'name': player['name'],
-            'played_machines': len(played_machines_per_player[player['abbreviation']]),
-            'total_machines': len(data['pinball_machines'])
-        }
-        for player in data['players'] if len(played_machines_per_player[player['abbreviation']]) > 0
-    ]
-
-    # Sortieren der Spieler nach der Anzahl der gespielten Maschinen in absteigender Reihenfolge
-    last_15_scores = data['scores'][-15:]
+    # Erstellen der Daten für die erste Tabelle (Spielerstatistiken), gespielte Maschinen aus dem Spielerindex
+    players_table_data = []
+    for player in data['players']:
+        stats = player_stats.stats.get(player['abbreviation'])
+        if stats is not None:
+            players_table_data.append({
+                'name': player['name'],
+                'played_machines': len(stats.machines),
+                'total_machines': len(data['pinball_machines'])
+            })
 
-    sorted_scores = last_15_scores[::-1]
-    # Hinzufügen von Ranginformationen zu jedem Score
+    # Die letzten 15 Scores, neueste zuerst; der Rang kommt aus der sortierten Punkteliste der Maschine
     scores_table_data = []
-    for score in sorted_scores:
-        machine_scores = sorted(
-            [s for s in data['scores'] if s['pinball_abbreviation'] == score['pinball_abbreviation']],
-            key=lambda x: x['points'], reverse=True)
-        rank = next((i + 1 for i, s in enumerate(machine_scores) if
-                     s['player_abbreviation'] == score['player_abbreviation'] and s['points'] == score['points']), "-")
-
+    for score in reversed(data['scores'][-15:]):
+        rank = score_index.position(score)
         scores_table_data.append({
             'machine_long_name': pinball_dict.get(score['pinball_abbreviation'], 'Unbekannte Maschine'),
             'player_full_name': player_dict.get(score['player_abbreviation'], 'Unbekannter Spieler'),
             'points': score['points'],
-            'rank': rank
+            'rank': rank if rank is not None else "-"
         })
 
-    return render_template('bigscreen.html', players_table_data=players_table_data, scores_table_data=scores_table_data)
+    return Markup(render_template('bigscreen_tables.html', players_table_data=players_table_data,
+                                  scores_table_data=scores_table_data))
 
 
 
@@ -196,115 +266,198 @@ def player_overview():
     return render_template('playeroverview.html')
 
 @app.route('/pinball', methods=['POST'])
+@state.writer
 def add_pinball():
     new_pinball = PinballMachine(**request.json)
-    data['pinball_machines'].append(vars(new_pinball))
-    save_data(data)
+    commit({'op': 'add_pinball', 'pinball': new_pinball.to_dict()})
     return jsonify({"message": "Pinball machine added"}), 201
 
 @app.route('/pinball', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_pinball_machines():
-    sorted_pinball_machines = sorted(data['pinball_machines'],
-                                     key=lambda x: x['long_name'],
-                                     reverse=False)
-    return jsonify(sorted_pinball_machines)
+    return cached_json('pinball', lambda: sorted(data['pinball_machines'],
+                                                 key=lambda x: x['long_name'],
+                                                 reverse=False))
 
 @app.route('/player', methods=['POST'])
+@state.writer
 def add_player():
     new_player = Player(**request.json)
-    data['players'].append(vars(new_player))
-    save_data(data)
+    commit({'op': 'add_player', 'player': new_player.to_dict()})
     return jsonify({"message": "Player added"}), 201
 
 @app.route('/players', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_players():
-    return jsonify(data['players'])
+    return cached_json('players', lambda: data['players'])
 
 
 @app.route('/get_player/<player_abbreviation>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_player(player_abbreviation):
-    # Find the specified player in the data list
-    player_info = next((player for player in data['players'] if player['abbreviation'] == player_abbreviation), None)
+    # Find the specified player
+    player_info = player_stats.players.get(player_abbreviation)
 
     if player_info is None:
         return jsonify({'error': 'Player not found'}), 404
 
-    # Initialize sets for played machines and dates
-    played_machines = set()
-    played_dates = set()  # Set for unique play dates
-    played_machines_info = []  # List for played machines with rank
-
-    # Loop through the scores to find machines played by the player
-    for score in data['scores']:
-        if score['player_abbreviation'] == player_abbreviation:
-            played_machines.add(score['pinball_abbreviation'])
-            played_dates.add(score['date'])  # Add the date to the set
-
-    # Collect information about the played machines and their ranks
-    for machine in played_machines:
-        # Find all scores for each machine
-        machine_scores = [s for s in data['scores'] if s['pinball_abbreviation'] == machine]
-        # Sort the scores in descending order
-        machine_scores.sort(key=lambda x: x['points'], reverse=True)
-        # Determine the rank of the player
-        rank = next((index for index, s in enumerate(machine_scores, start=1) if s['player_abbreviation'] == player_abbreviation), None)
-        played_machines_info.append({'machine': machine, 'rank': rank})
-
-    # Sort the played machines by rank in descending order
-    played_machines_info.sort(key=lambda x: x['rank'], reverse=True)
-
-    # Calculate tournament progress
-    total_machines = len(data['pinball_machines'])
-    machines_with_score = len(played_machines)
-    tournament_progress = f"{machines_with_score}/{total_machines}"
-
-    # Get the list of machines not yet played by the player
-    all_machines = set(machine['abbreviation'] for machine in data['pinball_machines'])
-    not_played_machines = all_machines - played_machines
-
-    # Return the extended player information
-    return jsonify({
-        'player_info': player_info,
-        'played_machines': played_machines_info,
-        'not_played_machines': list(not_played_machines),
-        'played_dates': len(played_dates),  # Number of unique play dates
-        'tournament_progress': tournament_progress  # Tournament progress in the format "X/Y"
-    })
+    def player_overview():
+        stats = player_stats.get(player_abbreviation)
+
+        # Collect information about the played machines and the player's rank on their leaderboard
+        played_machines_info = []
+        for machine in stats.machines:
+            entry = leaderboard.entry(machine, player_abbreviation)
+            played_machines_info.append({'machine': machine, 'rank': entry['rank'] if entry else None})
+
+        # Sort the played machines by rank in descending order
+        played_machines_info.sort(key=lambda x: x['rank'] or 0, reverse=True)
+
+        # Calculate tournament progress
+        total_machines = len(data['pinball_machines'])
+        machines_with_score = len(stats.machines)
+        tournament_progress = f"{machines_with_score}/{total_machines}"
+
+        # Return the extended player information
+        return {
+            'player_info': player_info,
+            'played_machines': played_machines_info,
+            'not_played_machines': player_stats.machines_in(player_stats.unplayed_mask(player_abbreviation)),
+            'played_dates': len(stats.dates),  # Number of unique play dates
+            'tournament_progress': tournament_progress  # Tournament progress in the format "X/Y"
+        }
+
+    return cached_json(('get_player', player_abbreviation), player_overview)
+
 @app.route('/score', methods=['POST'])
+@state.writer
 def add_score():
     new_score = Score(**request.json)
-    data['scores'].append(vars(new_score))
-    save_data(data)
-    return jsonify({"message": "Score added"}), 201
+    score = new_score.to_dict()
+    try:
+        check_points(score['points'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Optionally catch typos (an extra digit, ...) before they hit the leaderboard
+    verdict = None
+    if SCORE_VALIDATION != 'off':
+        verdict = score_statistics.check(score['pinball_abbreviation'], score['points'])
+        if SCORE_VALIDATION == 'reject' and not verdict['is_valid'] and not request.args.get('force'):
+            return jsonify({"error": "Implausible score", "validation": verdict}), 422
+
+    commit({'op': 'add_score', 'score': score})
+
+    response = {"message": "Score added"}
+    if verdict is not None:
+        response['validation'] = verdict
+    return jsonify(response), 201
+
+@app.route('/import/scores', methods=['POST'])
+def import_scores():
+    # Body: CSV, JSON lines or YAML (?format= or Content-Type), ?dry_run=1 only validates
+    format = request.args.get('format') or detect_format(content_type=request.content_type)
+    if format not in FORMATS:
+        return jsonify({"error": f"Unknown format, expected one of {', '.join(FORMATS)}"}), 400
+
+    # Read and convert the rows before taking the write lock, an upload may be slow
+    try:
+        scores, errors = parse_scores(read_rows(request.stream, format))
+    except BulkFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    return apply_import(scores, errors, arg_flag('dry_run'))
+
+def arg_flag(name):
+    # ?dry_run=1/true/yes, anything else (0, false, missing) is off
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+@state.writer
+def apply_import(scores, errors, dry_run):
+    validate = SCORE_VALIDATION
+    if validate == 'reject' and arg_flag('force'):
+        validate = 'warn'
+    accepted, summary = ScoreImport(state.current(), validate).run(scores, errors)
+
+    # All scores in one mutation: one pass over the indexes, one write to the storage backend
+    if accepted and not dry_run:
+        commit({'op': 'add_scores', 'scores': accepted})
+    summary['dry_run'] = dry_run
+    summary['message'] = f"{summary['imported']} scores {'valid' if dry_run else 'imported'}"
+    return jsonify(summary), 201 if accepted and not dry_run else 200
+
+@app.route('/export/scores', methods=['GET'])
+@conditional(data_version)
+@state.reader
+def export_all_scores():
+    # ?format=csv|jsonl|yaml, streamed in chunks
+    format = request.args.get('format', 'jsonl')
+    if format not in FORMATS:
+        return jsonify({"error": f"Unknown format, expected one of {', '.join(FORMATS)}"}), 400
+    # Only the list is copied, the score dicts are never modified
+    scores = list(data['scores'])
+    filename = f"scores-{datetime.date.today()}.{format}"
+    return app.response_class(export_scores(scores, format), mimetype=CONTENT_TYPES[format],
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/scores/pinball/<pinball_abbreviation>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_scores_by_pinball(pinball_abbreviation):
-    scores = [s for s in data['scores'] if s['pinball_abbreviation'] == pinball_abbreviation]
-    return jsonify(scores), 200
+    return paginate(score_index.machine(pinball_abbreviation))
 
 @app.route('/scores/player/<player_abbreviation>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_scores_by_player(player_abbreviation):
-    scores = [s for s in data['scores'] if s['player_abbreviation'] == player_abbreviation]
-    return jsonify(scores), 200
+    return paginate(score_index.player(player_abbreviation))
 
 @app.route('/scores/date/<date>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_scores_by_date(date):
-    date_obj = datetime.datetime.strptime(date, '%Y-%m-%d')
-    scores = [s for s in data['scores'] if datetime.datetime.strptime(s['date'], '%Y-%m-%d') == date_obj]
-    return jsonify(scores), 200
+    if not is_valid_date(date):
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+    return paginate(score_index.date(date))
+
+@app.route('/scores', methods=['GET'])
+@conditional(data_version)
+@state.reader
+def get_scores_by_date_range():
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD, both inclusive and optional, oldest first
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if not all(is_valid_date(date) for date in (date_from, date_to) if date):
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+    return paginate(score_index.date_range(date_from, date_to))
+
+def is_valid_date(date):
+    try:
+        datetime.datetime.strptime(date, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+def paginate(scores):
+    # Optional ?offset=&limit= for the score listings, the full count is sent in X-Total-Count
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    page = scores[offset:offset + max(limit, 0)] if limit is not None else scores[offset:]
+    response = jsonify(page)
+    response.headers['X-Total-Count'] = str(len(scores))
+    return response, 200
 
 @app.route('/delete_score/<pinball_abbreviation>/<player_abbreviation>/<int:score_value>', methods=['DELETE'])
+@state.writer
 def delete_score(pinball_abbreviation, player_abbreviation, score_value):
     # Finden des entsprechenden Scores
-    score_to_delete = next((score for score in data['scores']
-                            if score['pinball_abbreviation'] == pinball_abbreviation
-                            and score['player_abbreviation'] == player_abbreviation
-                            and score['points'] == score_value), None)
+    score_to_delete = state.current().find_score(pinball_abbreviation, player_abbreviation, score_value)
 
     if score_to_delete:
         # Score aus der Liste entfernen
-        data['scores'].remove(score_to_delete)
-        save_data(data)
+        commit({'op': 'delete_score', 'score': score_to_delete})
         return jsonify({"message": "Score deleted"}), 200
     else:
         return jsonify({"error": "Score not found"}), 404
@@ -312,288 +465,319 @@ def delete_score(pinball_abbreviation, player_abbreviation, score_value):
 
 
 @app.route('/highscore/pinball/<pinball_abbreviation>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_highscore_by_pinball(pinball_abbreviation):
-    highscores_with_points = calculate_highscores(pinball_abbreviation)
-    return jsonify(highscores_with_points), 200
+    return cached_json(('highscore', pinball_abbreviation), lambda: calculate_highscores(pinball_abbreviation))
+
+
+
+@app.route('/highscores', methods=['GET'])
+@conditional(data_version)
+@state.reader
+def get_highscores():
+    # All machine leaderboards in one response, optionally filtered: ?machines=A,B&room=1&top=15
+    machines_filter = request.args.get('machines')
+    room = request.args.get('room')
+    top = request.args.get('top', type=int)
+    if top is not None:
+        # A negative top would slice from the end
+        top = max(top, 0)
+
+    def highscores():
+        machines = data['pinball_machines']
+        if machines_filter:
+            wanted = set(machines_filter.split(','))
+            machines = [machine for machine in machines if machine['abbreviation'] in wanted]
+        if room:
+            machines = [machine for machine in machines if str(machine.get('room')) == room]
+
+        highscores = []
+        for machine in sorted(machines, key=lambda x: x['long_name']):
+            machine_highscores = calculate_highscores(machine['abbreviation'])
+            highscores.append({
+                'machine': machine,
+                'highscores': machine_highscores[:top] if top is not None else machine_highscores
+            })
+        return highscores
 
+    return cached_json(('highscores', machines_filter, room, top), highscores)
 
 
 @app.route('/total_highscore', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_total_highscore():
-    player_scores = {}
-    all_pinballs = set(score['pinball_abbreviation'] for score in data['scores'])
-    for pinball in all_pinballs:
-        highscores = calculate_highscores(pinball)
-        #print("Pinball: " + pinball + " Score: " + str(highscores))
-        #print(highscores)
-        for score in highscores:
-            player_scores[score['player']] = player_scores.get(score['player'], 0) + score['points']
-            sleep(0.000005) #ToDo: dirty fix for Full name display bug
-            #if str(score['player']) == "FC":
-            #    print("Player:" + str(score['player']) + " Sum: " + str(player_scores[score['player']]) + " " + str(score['points']) +" at Pin: " + pinball )
-
-    #print(player_scores)
-    sorted_scores = sorted(player_scores.items(), key=lambda x: x[1], reverse=True)
-    total_highscores_with_rank = []
-    rank = 1
-    for player, points in sorted_scores:
-        total_highscores_with_rank.append({
-            'rank': rank,
-            'player': player,
-            'total_points': points
-        })
-        rank += 1
-
-    return jsonify(total_highscores_with_rank), 200
-
-
+    # The standings are maintained by the leaderboard index, only serialize them once per version
+    return cached_json('total_highscore', leaderboard.total_standings)
 
 
 @app.route('/player/<player_abbreviation>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def print_scores_by_player(player_abbreviation):
     # Fetch all scores for the specified player
-    scores = [s for s in data['scores'] if s['player_abbreviation'] == player_abbreviation]
+    scores = score_index.player(player_abbreviation)
 
     if not scores:
         return jsonify({"error": f"No scores found for player '{player_abbreviation}'"}), 404
 
-    # Print the scores to the console
-    print(f"Scores for player '{player_abbreviation}':")
-    for score in scores:
-        print(f"Pinball: {score['pinball_abbreviation']}, Score: {score['points']}, Date: {score['date']}")
-
     # Return the scores as a JSON response
     return jsonify(scores), 200
 
 
 def calculate_highscores(pinball_abbreviation):
-    scores_by_player = {}
-
-    # Create a dictionary to quickly lookup if a player is a guest
-    player_guest_status = {player['abbreviation']: player.get('guest', False) for player in data['players']}
-
-    # Track the highest score for each player for the specific pinball machine
-    for score in data['scores']:
-        if score['pinball_abbreviation'] == pinball_abbreviation:
-            player_abbreviation = score['player_abbreviation']
-
-            if player_abbreviation not in scores_by_player or \
-                    scores_by_player[player_abbreviation]['points'] < score['points']:
-                scores_by_player[player_abbreviation] = score
-
-    # Convert the dictionary to a list and sort by points in descending order
-    highscores = list(scores_by_player.values())
-    highscores.sort(key=lambda x: x['points'], reverse=True)
-
-    # Assign ranking points, ensuring players with the same points get the same rank
-    highscores_with_rank_and_points = []
-    points = 15
-    rank = 1
-    previous_points = None
-    previous_rank = 1  # Keep track of the previous rank to ensure correct rank sharing
-
-    for score in highscores:
-        player_abbreviation = score['player_abbreviation']
-        is_guest = player_guest_status.get(player_abbreviation, False)
-
-        # If the current player's points are different from the previous player's points, update the rank
-        if previous_points is not None and score['points'] != previous_points:
-            previous_rank = rank  # Update previous rank to the current rank
-
-        # Ensure players ranked lower than 15 receive 0 points
-        assigned_points = points if rank <= 15 else 0
-
-        score_entry = {
-            'player': player_abbreviation,
-            'score': score['points'],
-            'rank': previous_rank,
-            'points': assigned_points
-        }
-
-        if is_guest:
-            score_entry['guest'] = True
+    # Served from the leaderboard index, which is kept up to date by every mutating route
+    return leaderboard.highscores(pinball_abbreviation)
 
-        highscores_with_rank_and_points.append(score_entry)
 
-        previous_points = score['points']
-        if not is_guest:
-            rank += 1
-
-        # Only decrement points if the player is not a guest and rank is within the top 15
-        if not is_guest and rank <= 15:
-            points -= 1 if points > 1 else 0
-
-    return highscores_with_rank_and_points
 @app.route('/player/<player_abbreviation>', methods=['DELETE'])
+@state.writer
 def delete_player(player_abbreviation):
-    # Find and delete all scores associated with the player
-    data['scores'] = [score for score in data['scores'] if score['player_abbreviation'] != player_abbreviation]
-
-    # Find and delete the player from the list of players
+    # Find the player and all scores associated with them
     player_to_delete = next((player for player in data['players'] if player['abbreviation'] == player_abbreviation), None)
+    has_scores = bool(score_index.player(player_abbreviation))
+
+    # Orphaned scores are removed as well, the journal has to know about that
+    if player_to_delete or has_scores:
+        commit({'op': 'delete_player', 'abbreviation': player_abbreviation})  # Save the updated data after deletion
 
     if player_to_delete:
-        data['players'].remove(player_to_delete)
-        save_data(data)  # Save the updated data after deletion
         return jsonify({"message": f"Player '{player_abbreviation}' and their scores deleted"}), 200
     else:
         return jsonify({"error": "Player not found"}), 404
 
 @app.route('/purgeguests', methods=['DELETE'])
+@state.writer
 def delete_all_guests():
     # Find all guest players (where 'guest' is True or exists and is True)
-    guest_players = [player for player in data['players'] if player.get('guest') is True]
-
-    # Iterate through the list of guest players and delete them
-    for guest in guest_players:
-        delete_player(guest['abbreviation'])
-
-    return jsonify({"message": f"{len(guest_players)} guest players deleted"}), 200
+    guest_players = [player['abbreviation'] for player in data['players'] if player.get('guest') is True]
+
+    # All guests and their scores in one batch, saved once
+    summary = delete_many(guest_players, (), ())
+    summary['message'] = f"{len(guest_players)} guest players deleted"
+    return jsonify(summary), 200
+
+@app.route('/batch/delete', methods=['POST'])
+@state.writer
+def batch_delete():
+    # {"players": [...], "machines": [...], "scores": [{"pinball_abbreviation", "player_abbreviation", "points"}]}
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    players = body.get('players', [])
+    machines = body.get('machines', [])
+    scores = body.get('scores', [])
+    if not (isinstance(players, list) and all(isinstance(player, str) for player in players)
+            and isinstance(machines, list) and all(isinstance(machine, str) for machine in machines)
+            and isinstance(scores, list) and all(isinstance(score, dict) for score in scores)):
+        return jsonify({"error": "players and machines must be lists of abbreviations, scores a list of objects"}), 400
+    try:
+        scores = [{'pinball_abbreviation': score['pinball_abbreviation'],
+                   'player_abbreviation': score['player_abbreviation'],
+                   'points': score['points']} for score in scores]
+    except KeyError as e:
+        return jsonify({"error": f"Score without {e.args[0]}"}), 400
+
+    summary = delete_many(players, machines, scores)
+    if not (summary['players'] or summary['machines'] or summary['scores']):
+        return jsonify(dict(summary, error="Nothing to delete")), 404
+    summary['message'] = (f"{len(summary['players'])} players, {len(summary['machines'])} pinball machines "
+                          f"and {summary['scores']} scores deleted")
+    return jsonify(summary), 200
+
+def delete_many(players, machines, scores):
+    # One 'delete_many' mutation: a single pass over the scores, one write to the storage backend
+    players = list(dict.fromkeys(players))
+    machines = list(dict.fromkeys(machines))
+    known_players = {player['abbreviation'] for player in data['players']}
+    known_machines = {machine['abbreviation'] for machine in data['pinball_machines']}
+    # Orphaned scores count as well, like in delete_player / delete_pinball_machine
+    found_players = [player for player in players if player in known_players or score_index.player(player)]
+    found_machines = [machine for machine in machines if machine in known_machines or score_index.machine(machine)]
+
+    result = {'players': [], 'machines': [], 'scores': [], 'missing_scores': scores}
+    if found_players or found_machines or any(state.current().find_score(score['pinball_abbreviation'],
+                                                                         score['player_abbreviation'],
+                                                                         score['points']) for score in scores):
+        result = commit({'op': 'delete_many', 'players': found_players, 'machines': found_machines, 'scores': scores})
+
+    return {
+        'players': [player['abbreviation'] for player in result['players']],
+        'machines': [machine['abbreviation'] for machine in result['machines']],
+        'scores': len(result['scores']),
+        'not_found': {
+            'players': [player for player in players if player not in found_players],
+            'machines': [machine for machine in machines if machine not in found_machines],
+            'scores': result['missing_scores']
+        }
+    }
 
 @app.route('/pinball/<pinball_abbreviation>', methods=['DELETE'])
+@state.writer
 def delete_pinball_machine(pinball_abbreviation):
-    # Step 1: Delete all scores related to the pinball machine
-    global data  # Ensuring we're modifying the global `data` object
-    original_score_count = len(data['scores'])
-    data['scores'] = [score for score in data['scores'] if score['pinball_abbreviation'] != pinball_abbreviation]
-    deleted_scores_count = original_score_count - len(data['scores'])
-
-    # Step 2: Delete the pinball machine itself
+    # Find the machine and all scores related to it
     pinball_to_delete = next((machine for machine in data['pinball_machines'] if machine['abbreviation'] == pinball_abbreviation), None)
+    has_scores = bool(score_index.machine(pinball_abbreviation))
+
+    # Orphaned scores are removed as well, the journal has to know about that
+    deleted_scores_count = 0
+    if pinball_to_delete or has_scores:
+        _, deleted_scores = commit({'op': 'delete_pinball', 'abbreviation': pinball_abbreviation})  # Save the updated data after deletion
+        deleted_scores_count = len(deleted_scores)
 
     if pinball_to_delete:
-        data['pinball_machines'].remove(pinball_to_delete)
-        save_data(data)  # Save the updated data after deletion
         return jsonify({"message": f"Pinball machine '{pinball_abbreviation}' and {deleted_scores_count} related scores deleted"}), 200
     else:
         return jsonify({"error": "Pinball machine not found"}), 404
 
 
 @app.route('/latestscores', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def get_latest_scores():
     # Get today's date in 'YYYY-MM-DD' format
     today = datetime.datetime.now().strftime('%Y-%m-%d')
 
-    # Filter scores for today's date
-    today_scores = [score for score in data['scores'] if score['date'] == today]
-
-    # Prepare the response list
-    latest_scores_response = []
-
-    # For each score submitted today, calculate rank using calculate_highscores
-    for score in today_scores:
-        pinball_abbreviation = score['pinball_abbreviation']
-        player_abbreviation = score['player_abbreviation']
-
-        # Calculate highscores for the pinball machine
-        highscores = calculate_highscores(pinball_abbreviation)
-
-        # Find the rank of the player in today's score within the high scores
-        rank = next((i + 1 for i, hs in enumerate(highscores) if hs['player'] == player_abbreviation), None)
-
-        latest_scores_response.append({
-            'player': player_abbreviation,
-            'pinball': pinball_abbreviation,
-            'points': score['points'],
-            'date': score['date'],
-            'rank': rank  # Include the calculated rank in the output
-        })
-
-    return jsonify(latest_scores_response), 200
+    def latest_scores():
+        # Filter scores for today's date
+        today_scores = score_index.date(today)
+
+        # Prepare the response list
+        latest_scores_response = []
+
+        # For each score submitted today, look up the player's position on the machine's leaderboard
+        for score in today_scores:
+            latest_scores_response.append({
+                'player': score['player_abbreviation'],
+                'pinball': score['pinball_abbreviation'],
+                'points': score['points'],
+                'date': score['date'],
+                'rank': leaderboard.position(score['pinball_abbreviation'], score['player_abbreviation'])
+            })
+        return latest_scores_response
+
+    return cached_json(('latestscores', today), latest_scores)
+
+@app.route('/leaderboard/day/<date>', methods=['GET'])
+@conditional(data_version)
+@state.reader
+def get_day_leaderboard(date):
+    # Standings of a single evening, /leaderboard/day/today for tonight
+    if date == 'today':
+        date = datetime.datetime.now().strftime('%Y-%m-%d')
+    if not is_valid_date(date):
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+    return window_leaderboard(date, date)
+
+@app.route('/leaderboard', methods=['GET'])
+@conditional(data_version)
+@state.reader
+def get_range_leaderboard():
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD, both inclusive and optional, e.g. this month
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if not all(is_valid_date(date) for date in (date_from, date_to) if date):
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+    return window_leaderboard(date_from, date_to)
+
+def window_leaderboard(date_from, date_to):
+    # Merged from the daily rollups, once per data version and window; ?top= like /highscores
+    top = request.args.get('top', type=int)
+    if top is not None:
+        # A negative top would slice from the end
+        top = max(top, 0)
+
+    def window():
+        highscores, standings = state.current().view(
+            ('leaderboard', date_from, date_to),
+            lambda: daily.leaderboard(leaderboard.guest_status, date_from, date_to))
+
+        machines = []
+        for machine in sorted(data['pinball_machines'], key=lambda x: x['long_name']):
+            machine_highscores = highscores.get(machine['abbreviation'])
+            if machine_highscores:
+                machines.append({
+                    'machine': machine,
+                    'highscores': machine_highscores[:top] if top is not None else machine_highscores
+                })
+        return {'from': date_from, 'to': date_to, 'total': standings, 'highscores': machines}
+
+    return cached_json(('window_leaderboard', date_from, date_to, top), window)
 
 @app.route('/matchsuggestion', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def match_suggestion():
     # Get today's date in 'YYYY-MM-DD' format
     today = datetime.datetime.now().strftime('%Y-%m-%d')
 
-    # Identify active players based on today's scores
-    today_scores = [score for score in data['scores'] if score['date'] == today]
-    active_players = {score['player_abbreviation'] for score in today_scores}
-
-    # Determine unplayed machines for each active player
-    player_unplayed_machines = {}
-    for player_abbr in active_players:
-        player_data_response = get_player(player_abbr)
-        player_data = player_data_response.json
-        if 'not_played_machines' in player_data:
-            player_unplayed_machines[player_abbr] = player_data['not_played_machines']
-
-    # Prepare match suggestions based on unplayed machines
-    match_suggestions = []
-    all_pinball_machines = set(machine['abbreviation'] for machine in data['pinball_machines'])
-
-    # Track the number of suggestions per player
-    suggestions_count = {player: 0 for player in active_players}
-
-    # Try to assign two players for each machine
-    for machine in all_pinball_machines:
-        # Get players who have not played this machine and have fewer than 2 suggestions
-        players_for_machine = [player for player, machines in player_unplayed_machines.items()
-                               if machine in machines and suggestions_count[player] < 2]
-
-        # Ensure there are at least two players who haven't played the machine
-        if len(players_for_machine) >= 2:
-            player1, player2 = players_for_machine[:2]  # Take the first two players
-            match_suggestions.append({
-                'pinball': machine,
-                'player1': player1,
-                'player2': player2
-            })
+    # Optional room filter, e.g. ?room=1,2
+    rooms = request.args.get('room')
+    rooms = tuple(sorted(rooms.split(','))) if rooms else None
 
-            # Increment suggestion counts
-            suggestions_count[player1] += 1
-            suggestions_count[player2] += 1
+    def suggestions():
+        # Identify active players based on today's scores, with their unplayed machines as bitsets
+        player_unplayed_machines = {player_abbr: player_stats.unplayed_mask(player_abbr)
+                                    for player_abbr in player_stats.active_players(today)
+                                    if player_abbr in player_stats.players}
+        machines = player_stats.machine_bits
+        if rooms is not None:
+            in_rooms = {machine['abbreviation'] for machine in data['pinball_machines']
+                        if str(machine.get('room')) in rooms}
+            machines = {machine: bit for machine, bit in machines.items() if machine in in_rooms}
 
-            # Remove players if they reached their maximum suggestions
-            if suggestions_count[player1] >= 2:
-                del player_unplayed_machines[player1]
-            if suggestions_count[player2] >= 2:
-                del player_unplayed_machines[player2]
+        return [{'pinball': machine, 'player1': player1, 'player2': player2}
+                for machine, player1, player2 in suggest_matches(player_unplayed_machines, machines)]
 
-    return jsonify(match_suggestions), 200
+    return cached_json(('matchsuggestion', today, rooms), suggestions)
 
 @app.route('/matchsuggestion/<player1>/<player2>', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def match_suggestion_for_players(player1, player2):
-    # Retrieve unplayed machines for player1
-    player1_data_response = get_player(player1)
-    player1_data = player1_data_response.json
-    if 'not_played_machines' not in player1_data:
-        return jsonify({'error': f'Player {player1} not found or data unavailable'}), 404
-
-    # Retrieve unplayed machines for player2
-    player2_data_response = get_player(player2)
-    player2_data = player2_data_response.json
-    if 'not_played_machines' not in player2_data:
-        return jsonify({'error': f'Player {player2} not found or data unavailable'}), 404
+    for player in (player1, player2):
+        if player not in player_stats.players:
+            return jsonify({'error': f'Player {player} not found or data unavailable'}), 404
 
     # Find common unplayed machines for both players
-    player1_unplayed = set(player1_data['not_played_machines'])
-    player2_unplayed = set(player2_data['not_played_machines'])
-    common_unplayed_machines = list(player1_unplayed.intersection(player2_unplayed))
+    common_unplayed = player_stats.unplayed_mask(player1) & player_stats.unplayed_mask(player2)
+    common_unplayed_machines = player_stats.machines_in(common_unplayed)
 
     return jsonify({'common_unplayed_machines': common_unplayed_machines}), 200
+
+@app.route('/events', methods=['GET'])
+def event_stream():
+    # Server-Sent Events; reconnecting clients resume from Last-Event-ID (or ?cursor=)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    return app.response_class(events.stream(last_event_id), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/persistence', methods=['GET'])
+def get_persistence_status():
+    # Pending write-behind state of the storage layer
+    return jsonify(persistence_status()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text format: request and storage timings plus the size of the data set;
+    # with several workers only summed up over all of them if METRICS_DIR is set (gunicorn.conf.py does)
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4'), 200
+
 @app.route('/getfreescores', methods=['GET'])
+@conditional(data_version)
+@state.reader
 def getfreescores():
-    # Create a dictionary to count scores for each pinball machine
-    score_counts = {}
-    # Count the number of scores for each pinball machine
-    for score in data['scores']:
-        pinball_abbr = score['pinball_abbreviation']
-        if pinball_abbr in score_counts:
-            score_counts[pinball_abbr] += 1
-        else:
-            score_counts[pinball_abbr] = 1
-        print(pinball_abbr +" "+ str(score_counts[pinball_abbr]))
-
-    # Identify machines with fewer than 15 scores
-    easy_machines = [abbr for abbr, count in score_counts.items() if count < 14]
-    # Ensure to include machines with zero scores
-    all_machines = {machine['abbreviation'] for machine in data['pinball_machines']}
-    machines_with_few_scores = set(easy_machines)
-    # Combine machines with few scores and no scores
-    result = list(machines_with_few_scores)
-
-    return jsonify(result), 200
+    def free_scores():
+        # Count the number of scores for each pinball machine
+        score_counts = score_index.machine_counts()
+
+        # Identify machines with fewer than 15 scores
+        easy_machines = [abbr for abbr, count in score_counts.items() if count < 14]
+        machines_with_few_scores = set(easy_machines)
+        return list(machines_with_few_scores)
+
+    return cached_json('getfreescores', free_scores)
 
 
 if __name__ == '__main__':
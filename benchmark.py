@@ -0,0 +1,271 @@
+"""
+Offline benchmark of the api.py endpoints.
+
+Generates a synthetic tournament, serves it from a throwaway journal directory
+(no Gist access) and drives the app through Flask's test client. Every endpoint
+is timed cold, right after a write invalidated the per-version caches, and
+warm, repeated on the same data version:
+
+    python benchmark.py --players 200 --machines 40 --scores 20000
+    python benchmark.py --scores 1000 5000 20000 50000   # how the views scale
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json   # exit code 1 on a regression
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def generate_data(players=100, machines=30, scores=5000, guest_ratio=0.2, days=60, rooms=2, seed=0):
+    """Synthetic tournament in the YAML schema. Scores are spread over the last `days` days, today included."""
+    rng = random.Random(seed)
+    player_list = [{'name': f'Player {index}', 'abbreviation': f'P{index:03d}',
+                    'guest': rng.random() < guest_ratio}
+                   for index in range(players)]
+    machine_list = [{'long_name': f'Machine {index}', 'abbreviation': f'M{index:02d}',
+                     'room': str(index % rooms + 1)}
+                    for index in range(machines)]
+
+    # Every machine has its own typical score range, a few players are much better than the rest
+    scales = [10 ** rng.uniform(4, 8) for _ in machine_list]
+    skills = [rng.lognormvariate(0, 0.5) for _ in player_list]
+    today = datetime.date.today()
+    score_list = []
+    for _ in range(scores):
+        player = rng.randrange(players)
+        machine = rng.randrange(machines)
+        points = int(scales[machine] * skills[player] * rng.lognormvariate(0, 0.6)) // 10 * 10
+        score_list.append({
+            'player_abbreviation': player_list[player]['abbreviation'],
+            'pinball_abbreviation': machine_list[machine]['abbreviation'],
+            'points': points,
+            'date': str(today - datetime.timedelta(days=rng.randrange(days)))
+        })
+    return {'players': player_list, 'pinball_machines': machine_list, 'scores': score_list}
+
+
+def load_app(data):
+    """Imports api.py on top of `data`, persisting into a temporary journal instead of the Gist."""
+    directory = tempfile.mkdtemp(prefix='aixplay-benchmark-')
+    with open(os.path.join(directory, 'snapshot.json'), 'w') as f:
+        json.dump({'seq': 0, 'data': data}, f)
+    os.environ['STORAGE_BACKEND'] = 'journal'
+    os.environ['JOURNAL_DIR'] = directory
+    with contextlib.redirect_stdout(io.StringIO()):
+        import api
+    return api
+
+
+def endpoints(data):
+    """(name, method, url, json body) of the requests to time, picked from `data`."""
+    rng = random.Random(1)
+    today = datetime.date.today()
+    players = [player['abbreviation'] for player in data['players']]
+    machines = [machine['abbreviation'] for machine in data['pinball_machines']]
+    player, other, machine = rng.choice(players), rng.choice(players), rng.choice(machines)
+    return [
+        ('highscore', 'GET', f'/highscore/pinball/{machine}', None),
+        ('highscores', 'GET', '/highscores?top=15', None),
+        ('total_highscore', 'GET', '/total_highscore', None),
+        ('bigscreen', 'GET', '/bigscreen', None),
+        ('get_player', 'GET', f'/get_player/{player}', None),
+        ('latestscores', 'GET', '/latestscores', None),
+        ('leaderboard_today', 'GET', '/leaderboard/day/today', None),
+        ('leaderboard_month', 'GET', f'/leaderboard?from={today - datetime.timedelta(days=30)}&to={today}&top=15', None),
+        ('matchsuggestion', 'GET', '/matchsuggestion', None),
+        ('matchsuggestion_pair', 'GET', f'/matchsuggestion/{player}/{other}', None),
+        ('score_overview', 'GET', f'/score-overview/{machine}/{player}', None),
+        ('preview_rank', 'GET', f'/preview-rank/{machine}/{player}/1000000', None),
+        ('scores_by_player', 'GET', f'/scores/player/{player}?limit=50', None),
+        ('scores_range', 'GET', f'/scores?from={today - datetime.timedelta(days=7)}&to={today}&limit=100', None),
+        ('getfreescores', 'GET', '/getfreescores', None),
+        ('admin_scores', 'GET', '/admin/scores?offset=100&limit=50', None),
+        ('export_scores', 'GET', '/export/scores?format=csv', None),
+        ('admin_scores_player', 'GET', f'/admin/scores?player={player}&limit=50', None),
+        ('validate_score', 'POST', '/validate_score', {'pinball_abbreviation': machine, 'new_score': 1000000}),
+        ('add_score', 'POST', '/score', {'player_abbreviation': player, 'pinball_abbreviation': machine,
+                                         'points': 123450, 'date': str(today)}),
+    ]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = (len(values) - 1) * q / 100
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+def measure(client, method, url, body, requests, write_body):
+    """
+    Latencies in ms of `requests` cold and warm calls, then the mean and peak
+    allocation of a few more cold calls under tracemalloc.
+
+    Before every cold call a score is added (not timed) and taken out again after
+    the warm one, so the caches start empty like after a new score on a real
+    evening while the data set keeps its size.
+    """
+    def call():
+        response = client.open(url, method=method, json=body)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {url} answered {response.status_code}')
+        return response
+
+    def write(index):
+        # Odd points, the generated scores are multiples of ten
+        score = dict(write_body, points=write_body['points'] + 2 * index + 1)
+        client.post('/score', json=score)
+        return score
+
+    def undo(score):
+        client.delete(f"/delete_score/{score['pinball_abbreviation']}/{score['player_abbreviation']}/{score['points']}")
+
+    cold = []
+    warm = []
+    for index in range(requests):
+        score = write(index)
+        start = time.perf_counter()
+        call()
+        cold.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        call()
+        warm.append((time.perf_counter() - start) * 1000)
+        undo(score)
+
+    allocated = []
+    peaks = []
+    for index in range(min(requests, 10)):
+        score = write(index)
+        tracemalloc.start()
+        call()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        undo(score)
+        allocated.append(current)
+        peaks.append(peak)
+
+    return {
+        'requests': requests,
+        'cold': latency_summary(cold),
+        'warm': latency_summary(warm),
+        'retained_kb': round(sum(allocated) / len(allocated) / 1024, 1),
+        'peak_kb': round(max(peaks) / 1024, 1),
+    }
+
+
+def latency_summary(latencies):
+    return {
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3),
+    }
+
+
+def run(args):
+    datasets = [generate_data(args.players, args.machines, scores, args.guest_ratio, args.days, args.rooms, args.seed)
+                for scores in args.scores]
+    start = time.perf_counter()
+    api = load_app(datasets[0])
+    startup_ms = (time.perf_counter() - start) * 1000
+    client = api.app.test_client()
+
+    sizes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for scores, data in zip(args.scores, datasets):
+            # Every size is loaded the same way, the first one included
+            start = time.perf_counter()
+            api.reload_data(data)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            requests = endpoints(data)
+            write_body = next(body for name, method, url, body in requests if name == 'add_score')
+            results = {}
+            for name, method, url, body in requests:
+                if args.only and name not in args.only:
+                    continue
+                results[name] = measure(client, method, url, body, args.requests, write_body)
+            sizes.append({'scores': scores, 'load_ms': round(load_ms, 1), 'endpoints': results})
+    return {
+        'dataset': {'players': args.players, 'machines': args.machines, 'guest_ratio': args.guest_ratio,
+                    'days': args.days, 'rooms': args.rooms, 'seed': args.seed},
+        'startup_ms': round(startup_ms, 1),
+        'sizes': sizes,
+    }
+
+
+def print_report(report):
+    print(f"dataset: {report['dataset']}, startup {report['startup_ms']} ms")
+    for size in report['sizes']:
+        print(f"\n{size['scores']} scores, loaded in {size['load_ms']} ms")
+        print(f"{'endpoint':<22}{'cold p50':>10}{'cold p99':>10}{'warm p50':>10}{'warm p99':>10}"
+              f"{'retained KB':>13}{'peak KB':>10}")
+        for name, result in size['endpoints'].items():
+            cold, warm = result['cold'], result['warm']
+            print(f"{name:<22}{cold['p50_ms']:>10.3f}{cold['p99_ms']:>10.3f}{warm['p50_ms']:>10.3f}"
+                  f"{warm['p99_ms']:>10.3f}{result['retained_kb']:>13.1f}{result['peak_kb']:>10.1f}")
+
+
+def regressions(report, baseline, tolerance):
+    """(size, endpoint, cold/warm, before, after) where p50 got more than `tolerance` (0.25 = 25 %) slower."""
+    slower = []
+    baseline_sizes = {size['scores']: size for size in baseline.get('sizes', ())}
+    for size in report['sizes']:
+        before_size = baseline_sizes.get(size['scores'])
+        if before_size is None:
+            continue
+        for name, result in size['endpoints'].items():
+            before = before_size['endpoints'].get(name)
+            for mode in ('cold', 'warm'):
+                # Sub-0.1 ms timings are mostly noise
+                if before and result[mode]['p50_ms'] > max(before[mode]['p50_ms'] * (1 + tolerance), 0.1):
+                    slower.append((size['scores'], name, mode, before[mode]['p50_ms'], result[mode]['p50_ms']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the api.py endpoints')
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--machines', type=int, default=30)
+    parser.add_argument('--scores', type=int, nargs='+', default=[5000], help='one or more data set sizes')
+    parser.add_argument('--guest-ratio', type=float, default=0.2)
+    parser.add_argument('--days', type=int, default=60, help='date spread of the scores')
+    parser.add_argument('--rooms', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--only', nargs='*', help='endpoint names to run')
+    parser.add_argument('--save', help='write the report as JSON')
+    parser.add_argument('--baseline', help='compare against a saved report')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['dataset'] != report['dataset']:
+            print('warning: baseline was measured on a different dataset')
+        slower = regressions(report, baseline, args.tolerance)
+        for scores, name, mode, before, after in slower:
+            print(f'REGRESSION {name} ({scores} scores, {mode}): p50 {before:.3f} ms -> {after:.3f} ms')
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
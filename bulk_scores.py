@@ -0,0 +1,410 @@
+"""
+Bulk import and export of scores as CSV, JSON lines or YAML.
+
+Imports are read as a stream, row by row, checked against the players,
+machines and scores already known and applied as a single 'add_scores'
+mutation, so the storage backend persists them once. Exports are generated
+in chunks and never hold the serialized dump in memory.
+
+    python bulk_scores.py import sheet.csv --url http://localhost:8080
+    python bulk_scores.py export scores.jsonl --url http://localhost:8080
+    STORAGE_BACKEND=sqlite python bulk_scores.py import season.yaml   # straight into the database
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import sys
+
+import yaml
+
+from models import Score
+from score_index import normalize_date
+from validation import SCORE_VALIDATION, check_points
+
+FORMATS = ('csv', 'jsonl', 'yaml')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'yaml': 'application/x-yaml',
+}
+# Scores serialized per chunk of an export
+EXPORT_CHUNK = 500
+# Points as written on paper sheets, optionally with thousands separators: 1.234.567, 1,234,567, 1 234 567
+POINTS_PATTERN = re.compile(r'\d+|\d{1,3}(?:([.,_ ])\d{3})(?:\1\d{3})*')
+# Rejected rows listed in the import summary, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class BulkFormatError(ValueError):
+    """The input can't be read any further (broken YAML, CSV without the score columns, ...)."""
+
+
+class BulkImportError(Exception):
+    """An import without a server can't be applied safely, or wasn't persisted."""
+
+
+def detect_format(name=None, content_type=None):
+    """The format for a file name or Content-Type, None if it is neither of FORMATS."""
+    if name:
+        extension = os.path.splitext(name)[1].lower().lstrip('.')
+        extension = {'ndjson': 'jsonl', 'yml': 'yaml'}.get(extension, extension)
+        if extension in FORMATS:
+            return extension
+    if content_type:
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+            return 'jsonl'
+        if 'csv' in content_type:
+            return 'csv'
+        if 'yaml' in content_type:
+            return 'yaml'
+    return None
+
+
+def read_rows(stream, format):
+    """Yields (row number, raw row) from a binary stream, without reading all of it first."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if format == 'csv' else None)
+    if format == 'csv':
+        rows = _read_csv(text)
+    elif format == 'jsonl':
+        rows = _read_jsonl(text)
+    elif format == 'yaml':
+        rows = _read_yaml(text)
+    else:
+        raise BulkFormatError(f"Unknown format '{format}', expected one of {', '.join(FORMATS)}")
+    return enumerate(rows, start=1)
+
+
+def _read_csv(text):
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None:
+        return
+    missing = set(Score.__slots__) - {name.strip() for name in reader.fieldnames}
+    if missing:
+        raise BulkFormatError(f"CSV header lacks the columns {', '.join(sorted(missing))}")
+    for row in reader:
+        yield {key.strip(): value for key, value in row.items() if key is not None}
+
+
+def _read_jsonl(text):
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            # A broken line only costs that row
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+def _read_yaml(text):
+    # Works on parser events: either a list of scores or a whole data file, of which
+    # only the 'scores' list is read. All values come in as strings, normalize_score converts them.
+    events = yaml.parse(text, Loader=_Loader)
+    try:
+        for event in events:
+            if isinstance(event, yaml.SequenceStartEvent):
+                yield from _yaml_sequence(events)
+            elif isinstance(event, yaml.MappingStartEvent):
+                for key in events:
+                    if isinstance(key, yaml.MappingEndEvent):
+                        break
+                    value = next(events)
+                    if isinstance(key, yaml.ScalarEvent) and key.value == 'scores' \
+                            and isinstance(value, yaml.SequenceStartEvent):
+                        yield from _yaml_sequence(events)
+                    else:
+                        _yaml_skip(events, key)
+                        _yaml_skip(events, value)
+    except yaml.YAMLError as e:
+        raise BulkFormatError(f"Invalid YAML: {e}")
+
+
+def _yaml_sequence(events):
+    for event in events:
+        if isinstance(event, yaml.SequenceEndEvent):
+            return
+        if isinstance(event, yaml.MappingStartEvent):
+            yield _yaml_mapping(events)
+        else:
+            _yaml_skip(events, event)
+            yield ValueError("Not a mapping")
+
+
+def _yaml_mapping(events):
+    row = {}
+    for key in events:
+        if isinstance(key, yaml.MappingEndEvent):
+            break
+        value = next(events)
+        if isinstance(key, yaml.ScalarEvent) and isinstance(value, yaml.ScalarEvent):
+            row[key.value] = value.value
+        else:
+            _yaml_skip(events, key)
+            _yaml_skip(events, value)
+    return row
+
+
+def _yaml_skip(events, event):
+    # Consumes the rest of a nested collection
+    depth = 1 if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)) else 0
+    while depth:
+        event = next(events)
+        if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)):
+            depth += 1
+        elif isinstance(event, (yaml.SequenceEndEvent, yaml.MappingEndEvent)):
+            depth -= 1
+
+
+def normalize_score(row):
+    """A score dict in the data schema from a raw row. Raises ValueError with the reason."""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("Not a mapping")
+
+    values = {}
+    for field in Score.__slots__:
+        value = row.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            raise ValueError(f"Missing {field}")
+        values[field] = value.strip() if isinstance(value, str) else value
+
+    points = values['points']
+    if isinstance(points, bool) or not isinstance(points, (int, str)):
+        raise ValueError(f"Invalid points '{points}'")
+    if isinstance(points, str):
+        if not POINTS_PATTERN.fullmatch(points):
+            raise ValueError(f"Invalid points '{points}'")
+        points = int(re.sub(r'\D', '', points))
+    if points < 0:
+        raise ValueError(f"Invalid points '{points}'")
+
+    date = str(values['date'])
+    try:
+        # Stored zero-padded like the dates the app writes, 2024-3-7 becomes 2024-03-07
+        date = datetime.datetime.strptime(date, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date '{date}', expected YYYY-MM-DD")
+
+    return Score(str(values['player_abbreviation']), str(values['pinball_abbreviation']), points, date).to_dict()
+
+
+def parse_scores(rows):
+    """Normalizes the rows. Returns (scores as (row number, score), errors as {'row', 'error'})."""
+    scores = []
+    errors = []
+    for number, row in rows:
+        try:
+            scores.append((number, normalize_score(row)))
+        except ValueError as e:
+            errors.append({'row': number, 'error': str(e)})
+    return scores, errors
+
+
+class ScoreImport:
+    """
+    Checks normalized scores against a TournamentState: player and machine have
+    to exist, a score already in the data (same player, machine, points and date)
+    or earlier in the import is skipped as a duplicate. With `validate` the
+    plausibility check of validation.py runs as well (see SCORE_VALIDATION),
+    'reject' drops implausible scores, 'flag' and 'warn' only count them.
+    """
+
+    def __init__(self, state, validate='off'):
+        self.state = state
+        self.validate = validate
+        self.machines = {machine['abbreviation'] for machine in state.data['pinball_machines']}
+        self.players = {player['abbreviation'] for player in state.data['players']}
+        self.seen = {}  # machine -> {(player, points, date)}, filled per machine on first use
+
+    def _known(self, pinball_abbreviation):
+        known = self.seen.get(pinball_abbreviation)
+        if known is None:
+            known = self.seen[pinball_abbreviation] = {
+                (score['player_abbreviation'], score['points'], normalize_date(score['date']))
+                for score in self.state.score_index.machine(pinball_abbreviation)}
+        return known
+
+    def run(self, scores, errors=()):
+        """Returns (scores to add, summary)."""
+        accepted = []
+        errors = list(errors)
+        duplicates = 0
+        warnings = 0
+        for number, score in scores:
+            machine = score['pinball_abbreviation']
+            if score['player_abbreviation'] not in self.players:
+                errors.append({'row': number, 'error': f"Unknown player '{score['player_abbreviation']}'"})
+                continue
+            if machine not in self.machines:
+                errors.append({'row': number, 'error': f"Unknown pinball machine '{machine}'"})
+                continue
+
+            try:
+                check_points(score['points'])
+            except ValueError as e:
+                errors.append({'row': number, 'error': str(e)})
+                continue
+
+            key = (score['player_abbreviation'], score['points'], score['date'])
+            known = self._known(machine)
+            if key in known:
+                duplicates += 1
+                continue
+
+            if self.validate != 'off' and not self.state.score_statistics.check(machine, score['points'])['is_valid']:
+                if self.validate == 'reject':
+                    errors.append({'row': number, 'error': f"Implausible score {score['points']} on {machine}"})
+                    continue
+                warnings += 1
+
+            known.add(key)
+            accepted.append(score)
+
+        errors.sort(key=lambda error: error['row'])
+        summary = {
+            'imported': len(accepted),
+            'duplicates': duplicates,
+            'rejected': len(errors),
+            'errors': errors[:MAX_REPORTED_ERRORS],
+        }
+        if self.validate != 'off':
+            summary['warnings'] = warnings
+        return accepted, summary
+
+
+def export_scores(scores, format, chunk=EXPORT_CHUNK):
+    """Generator of the serialized `scores` (a list that isn't modified anymore), `chunk` scores at a time."""
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format '{format}', expected one of {', '.join(FORMATS)}")
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=Score.__slots__, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        yield buffer.getvalue()
+    elif format == 'yaml':
+        yield "scores:\n" if scores else "scores: []\n"
+
+    for start in range(0, len(scores), chunk):
+        part = scores[start:start + chunk]
+        if format == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(part)
+            yield buffer.getvalue()
+        elif format == 'jsonl':
+            yield ''.join(json.dumps(score, ensure_ascii=False) + "\n" for score in part)
+        else:
+            yield yaml.safe_dump(part, default_flow_style=False, allow_unicode=True)
+
+
+def import_into_backend(path, format, validate='off', dry_run=False):
+    """
+    CLI import without a running server: applies the scores to the storage backend
+    directly. Only the sqlite backend is safe for that, a running server picks the
+    import up like the write of another worker. The journal and the Gist belong to
+    the one process serving them: its next compaction or upload would drop the
+    import, and the Gist cache may be stale. Raises BulkImportError.
+    """
+    from data_manager import backend, load_data, save_data, write_transaction, flush_data
+    from state import TournamentState
+
+    if not backend.shared:
+        raise BulkImportError(f"Importing without --url needs STORAGE_BACKEND=sqlite, the {backend.name} "
+                              "backend belongs to the server: use --url with the running server")
+
+    with open(path, 'rb') as f:
+        scores, errors = parse_scores(read_rows(f, format))
+
+    def on_mutations(mutations):
+        for mutation in mutations:
+            current.apply(mutation)
+
+    def on_reload(data):
+        current.rebuild(data)
+
+    current = TournamentState(load_data())
+    with write_transaction(on_mutations, on_reload):
+        accepted, summary = ScoreImport(current, validate).run(scores, errors)
+        if accepted and not dry_run:
+            mutation = {'op': 'add_scores', 'scores': accepted}
+            current.apply(mutation)
+            save_data(current.data, mutation)
+    if not flush_data():
+        raise BulkImportError(f"The import was not persisted: {backend.status().get('last_error') or 'flush timed out'}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import and export of scores')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('path', help="file to read or write, '-' for stdin/stdout")
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--url', help='running server, e.g. http://localhost:8080; '
+                                      'without it the scores go straight into the database (STORAGE_BACKEND=sqlite only)')
+    parser.add_argument('--dry-run', action='store_true', help='only validate, import nothing')
+    parser.add_argument('--force', action='store_true', help='import implausible scores too (SCORE_VALIDATION=reject)')
+    args = parser.parse_args(argv)
+
+    format = args.format or detect_format(args.path) or 'jsonl'
+
+    if args.command == 'export':
+        if args.url:
+            import requests
+            response = requests.get(f"{args.url.rstrip('/')}/export/scores", params={'format': format},
+                                    stream=True, timeout=(5, 300))
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=65536)
+        else:
+            # The storage backend reports on stdout, which may be the export itself
+            with contextlib.redirect_stdout(sys.stderr):
+                from data_manager import load_data
+                scores = load_data()['scores']
+            chunks = (chunk.encode('utf-8') for chunk in export_scores(scores, format))
+        out = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+        with out:
+            for chunk in chunks:
+                out.write(chunk)
+        return 0
+
+    if args.url:
+        import requests
+        source = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+        with source:
+            params = {'format': format}
+            if args.dry_run:
+                params['dry_run'] = '1'
+            if args.force:
+                params['force'] = '1'
+            response = requests.post(f"{args.url.rstrip('/')}/import/scores", params=params, data=source,
+                                     headers={'Content-Type': CONTENT_TYPES[format]}, timeout=(5, 300))
+        summary = response.json()
+        if response.status_code >= 400:
+            print(summary.get('error', response.text), file=sys.stderr)
+            return 1
+    else:
+        if args.path == '-':
+            parser.error("reading from stdin needs --url")
+        validate = 'warn' if args.force and SCORE_VALIDATION == 'reject' else SCORE_VALIDATION
+        try:
+            summary = import_into_backend(args.path, format, validate, args.dry_run)
+        except (BulkFormatError, BulkImportError) as e:
+            print(e, file=sys.stderr)
+            return 1
+
+    for error in summary.pop('errors', []):
+        print(f"row {error['row']}: {error['error']}", file=sys.stderr)
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
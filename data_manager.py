@@ -2,43 +2,861 @@ import yaml
 import os
 import requests
 import json
+import logging
+import threading
+import time
+import atexit
+import pickle
+import sqlite3
+from contextlib import contextmanager, nullcontext
 
-GIST_ID = os.environ['GIST_ID']
-TOKEN = os.environ['TOKEN']
-GIST_FILENAME = os.environ['GIST_FILENAME']
-
-headers = {"Authorization": f"token {TOKEN}"}
-
-def fetch_gist_content():
-    url = f"https://api.github.com/gists/{GIST_ID}"
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    gist_data = response.json()
-    return gist_data['files'][GIST_FILENAME]['content']
-
-def update_gist(content):
-    url = f"https://api.github.com/gists/{GIST_ID}"
-    data = {
-        "files": {
-            GIST_FILENAME: {
-                "content": content
+from metrics import metrics, SIZE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# 'gist' keeps everything in one YAML file of a GitHub Gist,
+# 'journal' appends every mutation to a local file (see JournalBackend),
+# 'sqlite' shares a mutation log between several worker processes (see SqliteBackend)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'gist')
+JOURNAL_DIR = os.environ.get('JOURNAL_DIR', 'data')
+# Number of journal records after which the journal is compacted into a snapshot
+JOURNAL_COMPACT_EVERY = int(os.environ.get('JOURNAL_COMPACT_EVERY', '1000'))
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'data/aixplay.sqlite3')
+# How often (seconds) an idle worker looks for changes written by the other workers
+SYNC_INTERVAL = float(os.environ.get('SYNC_INTERVAL', '1'))
+
+# Local copy of the last known Gist revision, loaded at startup instead of waiting for GitHub
+GIST_CACHE = os.environ.get('GIST_CACHE', 'data/gist-cache.pickle')
+# Bumped whenever the layout of the cache file changes, older caches are ignored
+CACHE_SCHEMA_VERSION = 1
+
+# Mutations arriving within this window (seconds) are written to the Gist in a single PATCH
+SAVE_DELAY = float(os.environ.get('SAVE_DELAY', '2'))
+# Upper bound for the retry backoff after a failed upload
+SAVE_MAX_BACKOFF = float(os.environ.get('SAVE_MAX_BACKOFF', '60'))
+# Seconds to wait for GitHub to accept the connection and to send a response
+GIST_CONNECT_TIMEOUT = float(os.environ.get('GIST_CONNECT_TIMEOUT', '5'))
+GIST_READ_TIMEOUT = float(os.environ.get('GIST_READ_TIMEOUT', '30'))
+
+
+def empty_data():
+    return {"pinball_machines": [], "players": [], "scores": []}
+
+def snapshot_data(data):
+    # Copy the lists so later mutations don't leak into a snapshot being written;
+    # the score/player/machine dicts themselves are never modified after creation
+    return {key: list(value) if isinstance(value, list) else value for key, value in data.items()}
+
+def apply_mutation(data, mutation):
+    """
+    Applies a single mutation record to `data`, the same way the api routes do.
+
+    Records look like {'op': 'add_score', 'score': {...}}. They are written by the
+    routes through save_data() and replayed by the journal backend on load.
+    """
+    op = mutation['op']
+    if op == 'add_score':
+        data['scores'].append(mutation['score'])
+    elif op == 'add_scores':
+        # Bulk import (bulk_scores.py), persisted as one record
+        data['scores'].extend(mutation['scores'])
+    elif op == 'delete_score':
+        score = mutation['score']
+        score_to_delete = next((s for s in data['scores']
+                                if s['pinball_abbreviation'] == score['pinball_abbreviation']
+                                and s['player_abbreviation'] == score['player_abbreviation']
+                                and s['points'] == score['points']), None)
+        if score_to_delete:
+            data['scores'].remove(score_to_delete)
+    elif op == 'add_player':
+        data['players'].append(mutation['player'])
+    elif op == 'delete_player':
+        abbreviation = mutation['abbreviation']
+        data['scores'] = [s for s in data['scores'] if s['player_abbreviation'] != abbreviation]
+        player = next((p for p in data['players'] if p['abbreviation'] == abbreviation), None)
+        if player:
+            data['players'].remove(player)
+    elif op == 'delete_many':
+        players, machines, pending = delete_many_filter(mutation)
+        data['scores'] = [s for s in data['scores'] if keep_score(s, players, machines, pending)]
+        data['players'] = [p for p in data['players'] if p['abbreviation'] not in players]
+        data['pinball_machines'] = [m for m in data['pinball_machines'] if m['abbreviation'] not in machines]
+    elif op == 'add_pinball':
+        data['pinball_machines'].append(mutation['pinball'])
+    elif op == 'delete_pinball':
+        abbreviation = mutation['abbreviation']
+        data['scores'] = [s for s in data['scores'] if s['pinball_abbreviation'] != abbreviation]
+        machine = next((m for m in data['pinball_machines'] if m['abbreviation'] == abbreviation), None)
+        if machine:
+            data['pinball_machines'].remove(machine)
+    else:
+        raise ValueError(f"Unknown mutation '{op}'")
+
+
+def delete_many_filter(mutation):
+    """
+    Players, machines and pending single scores of a 'delete_many' record, for keep_score().
+
+    The record deletes players and machines with all their scores, then each of
+    its scores the way 'delete_score' does: the first remaining one with the same
+    machine, player and points.
+    """
+    pending = {}
+    for score in mutation.get('scores', ()):
+        key = (score['pinball_abbreviation'], score['player_abbreviation'], score['points'])
+        pending[key] = pending.get(key, 0) + 1
+    return set(mutation.get('players', ())), set(mutation.get('machines', ())), pending
+
+def keep_score(score, players, machines, pending):
+    """
+    False for a score deleted by a 'delete_many' record, called once per score in
+    data order. A listed score is taken off `pending` whichever filter deletes it,
+    so what is left in `pending` matched nothing.
+    """
+    key = (score['pinball_abbreviation'], score['player_abbreviation'], score['points'])
+    deleted = score['player_abbreviation'] in players or score['pinball_abbreviation'] in machines
+    if pending.get(key):
+        pending[key] -= 1
+        return False
+    return not deleted
+
+
+class WriteBehindPersister:
+    """
+    Persists snapshots in a background thread.
+
+    Only the most recent snapshot is kept, so any number of mutations within
+    `delay` seconds end up in one write. Failed writes are retried with
+    exponential backoff; a newer snapshot submitted meanwhile replaces the
+    failed one.
+    """
+
+    def __init__(self, write, delay=SAVE_DELAY, max_backoff=SAVE_MAX_BACKOFF):
+        self.write = write
+        self.delay = delay
+        self.max_backoff = max_backoff
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pending = None
+        self._pending_since = None
+        self._pending_mutations = 0
+        self._writing = False
+        self._retry_at = None
+        self._backoff = 0
+        self.last_flushed = None
+        self.last_error = None
+        self.flush_count = 0
+        self.failure_count = 0
+
+    def submit(self, snapshot):
+        with self._condition:
+            if self._pending is None:
+                self._pending_since = time.time()
+            self._pending = snapshot
+            self._pending_mutations += 1
+            self._ensure_thread()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Write the pending snapshot now. Returns True once nothing is pending."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # Skip the coalescing window and any retry backoff
+            self._pending_since = 0
+            self._retry_at = None
+            self._condition.notify_all()
+            while self._pending is not None or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def superseded(self):
+        """Whether a newer snapshot is already waiting, for writers that can skip stale ones."""
+        with self._condition:
+            return self._pending is not None
+
+    def status(self):
+        with self._condition:
+            pending = self._pending is not None or self._writing
+            return {
+                'pending': pending,
+                'pending_mutations': self._pending_mutations,
+                'pending_since': (self._pending_since or None) if pending else None,
+                'last_flushed': self.last_flushed,
+                'last_error': self.last_error,
+                'flush_count': self.flush_count,
+                'failure_count': self.failure_count
+            }
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _next_write_at(self):
+        due = self._pending_since + self.delay
+        if self._retry_at is not None:
+            due = max(due, self._retry_at)
+        return due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                # Coalesce: keep collecting mutations until the window (or backoff) has passed
+                while time.time() < self._next_write_at():
+                    self._condition.wait(self._next_write_at() - time.time())
+
+                snapshot = self._pending
+                mutations = self._pending_mutations
+                self._pending = None
+                self._pending_mutations = 0
+                self._writing = True
+
+            try:
+                self.write(snapshot)
+            except Exception as e:
+                logger.error("Error saving data: %s", e)
+                with self._condition:
+                    self.failure_count += 1
+                    self.last_error = str(e)
+                    self._backoff = min(self.max_backoff, (self._backoff * 2) or 1)
+                    self._retry_at = time.time() + self._backoff
+                    if self._pending is None:
+                        self._pending = snapshot
+                        self._pending_since = time.time()
+                    self._pending_mutations += mutations
+                    self._writing = False
+                    self._condition.notify_all()
+            else:
+                with self._condition:
+                    self.flush_count += 1
+                    self.last_flushed = time.time()
+                    self.last_error = None
+                    self._backoff = 0
+                    self._retry_at = None
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+class StorageBackend:
+    """
+    Where the tournament data lives.
+
+    `save` persists a full snapshot, `append` persists a single mutation record
+    (see apply_mutation). Backends that can't store individual mutations simply
+    fall back to saving the snapshot.
+    """
+
+    # Whether load_cached() may be behind and needs a reconcile() afterwards
+    remote = False
+    # Whether other processes write to the same storage (see SqliteBackend)
+    shared = False
+    # Label of the storage metrics
+    name = 'storage'
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, data):
+        raise NotImplementedError
+
+    def append(self, mutation, data):
+        self.save(data)
+
+    def load_cached(self):
+        """Fast local load at startup, or None if there is nothing local to load from."""
+        return self.load()
+
+    def reconcile(self, exclusive=nullcontext, on_reload=None):
+        """
+        Syncs with the remote after load_cached(). Newer data goes to `on_reload`,
+        still inside `exclusive` (the writers' lock). Returns whether there was any.
+        """
+        return False
+
+    def flush(self, timeout=None):
+        return True
+
+    def status(self):
+        return {}
+
+    def has_changes(self):
+        """Whether another process wrote something this one hasn't applied yet."""
+        return False
+
+    def version(self):
+        """
+        Persisted (epoch, position) of the loaded data, the same in every process
+        holding the same data; None if the data only changes in this process.
+        """
+        return None
+
+    def catch_up(self, on_mutations, on_reload):
+        """Hands the mutations written by other processes to `on_mutations` (or everything to `on_reload`)."""
+
+    def transaction(self, on_mutations, on_reload):
+        """Context for a write: excludes writers of other processes and catches up with them first."""
+        return nullcontext()
+
+    def timed(self, operation):
+        return metrics.timed('aixplay_storage_duration_seconds', backend=self.name, operation=operation)
+
+    def observe_size(self, operation, size):
+        metrics.observe('aixplay_storage_payload_bytes', size, buckets=SIZE_BUCKETS,
+                        backend=self.name, operation=operation)
+
+
+class GistBackend(StorageBackend):
+    """
+    The whole dataset as one YAML file in a GitHub Gist, written behind the requests.
+
+    Every uploaded or downloaded revision is also cached on disk (`cache_path`),
+    so a restart can serve from the cache right away and reconcile with the Gist
+    in the background. Mutations made before that reconciliation are replayed on
+    top of the Gist content if it turns out to be newer, and uploads wait until
+    the reconciliation is done so a stale cache never overwrites the Gist.
+    """
+
+    remote = True
+    name = 'gist'
+
+    def __init__(self, gist_id, token, filename, cache_path=GIST_CACHE):
+        self.enabled = bool(gist_id and token and filename)
+        self.url = f"https://api.github.com/gists/{gist_id}"
+        self.filename = filename
+        self.headers = {"Authorization": f"token {token}"}
+        # One pooled session, so uploads and fetches reuse the TLS connection to GitHub
+        self.session = requests.Session()
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.timeout = (GIST_CONNECT_TIMEOUT, GIST_READ_TIMEOUT)
+        self.cache_path = cache_path
+        self.revision = None
+        self.etag = None
+        self.reconciled = threading.Event()
+        self._unreconciled = []
+        self._lock = threading.Lock()
+        self.persister = WriteBehindPersister(self.write_snapshot)
+        if not self.enabled:
+            logger.warning("GIST_ID, TOKEN or GIST_FILENAME not set, changes will not be uploaded")
+            self.reconciled.set()
+
+    def fetch_gist(self, etag=None):
+        """Returns (content, revision, etag), or None if the Gist still matches `etag`."""
+        if not self.enabled:
+            raise RuntimeError("Gist is not configured")
+        headers = dict(self.headers)
+        if etag:
+            headers['If-None-Match'] = etag
+        with self.timed('gist_fetch'):
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        self.observe_size('gist_fetch', len(response.content))
+        gist_data = response.json()
+        return (gist_data['files'][self.filename]['content'],
+                gist_data['history'][0]['version'],
+                response.headers.get('ETag'))
+
+    def update_gist(self, content):
+        if not self.enabled:
+            raise RuntimeError("Gist is not configured")
+        data = {
+            "files": {
+                self.filename: {
+                    "content": content
+                }
             }
         }
-    }
-    response = requests.patch(url, headers=headers, data=json.dumps(data))
-    response.raise_for_status()
-    return response.json()
+        body = json.dumps(data)
+        self.observe_size('gist_update', len(body))
+        with self.timed('gist_update'):
+            response = self.session.patch(self.url, headers=self.headers, data=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def write_snapshot(self, data):
+        self.reconciled.wait()
+        if self.persister.superseded():
+            return
+        with self.timed('yaml_dump'):
+            content = yaml.dump(data)
+        gist_data = self.update_gist(content)
+        self.revision = gist_data['history'][0]['version']
+        self.etag = None
+        self.write_cache(data)
+
+    def read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with self.timed('cache_read'), open(self.cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            logger.warning("Ignoring unreadable cache %s: %s", self.cache_path, e)
+            return None
+        if cache.get('schema') != CACHE_SCHEMA_VERSION:
+            return None
+        return cache
+
+    def write_cache(self, data):
+        if not self.cache_path:
+            return
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with self.timed('cache_write'), open(tmp_path, 'wb') as f:
+            pickle.dump({'schema': CACHE_SCHEMA_VERSION, 'revision': self.revision, 'etag': self.etag,
+                         'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
+
+    def load(self):
+        content, self.revision, self.etag = self.fetch_gist()
+        with self.timed('yaml_load'):
+            data = yaml.safe_load(content)
+        self.write_cache(data)
+        self.reconciled.set()
+        return data
+
+    def load_cached(self):
+        cache = self.read_cache()
+        if cache is None:
+            return None
+        self.revision = cache['revision']
+        self.etag = cache['etag']
+        return cache['data']
+
+    def reconcile(self, exclusive=nullcontext, on_reload=None):
+        if self.reconciled.is_set():
+            return False
+        result = self.fetch_gist(self.etag)
+        data = None
+        if result is not None and result[1] != self.revision:
+            with self.timed('yaml_load'):
+                data = yaml.safe_load(result[0]) or empty_data()
+
+        # Merge and reload in one step: a commit in between would upload the stale
+        # in-memory data and then be lost from memory by the reload
+        with exclusive(), self._lock:
+            unreconciled, self._unreconciled = self._unreconciled, []
+            if data is None:
+                if result is not None:
+                    self.etag = result[2]
+                self.reconciled.set()
+                return False
+
+            _, self.revision, self.etag = result
+            for mutation in unreconciled:
+                apply_mutation(data, mutation)
+            if unreconciled:
+                # Supersedes any upload still based on the stale cache
+                self.save(data)
+            # Before the uploads resume, those write the cache as well
+            self.write_cache(data)
+            if on_reload is not None:
+                on_reload(data)
+            self.reconciled.set()
+        return True
+
+    def append(self, mutation, data):
+        with self._lock:
+            if not self.reconciled.is_set():
+                self._unreconciled.append(mutation)
+        self.save(data)
+
+    def save(self, data):
+        # Without a Gist there is nowhere to upload to, queueing would only retry forever
+        if self.enabled:
+            self.persister.submit(snapshot_data(data))
+
+    def flush(self, timeout=None):
+        return self.persister.flush(timeout)
+
+    def status(self):
+        status = self.persister.status()
+        status.update({'revision': self.revision, 'reconciled': self.reconciled.is_set()})
+        return status
+
+
+class JournalBackend(StorageBackend):
+    """
+    Local append-only journal with periodic compaction.
+
+    Every mutation is appended as one JSON line to journal.jsonl, so a write costs
+    the same no matter how much history exists. After `compact_every` records the
+    journal is rotated and a full snapshot (snapshot.json) is written in the
+    background; records already contained in the snapshot are skipped on load.
+    """
+
+    SNAPSHOT = 'snapshot.json'
+    JOURNAL = 'journal.jsonl'
+    ROTATED_JOURNAL = 'journal.jsonl.old'
+
+    name = 'journal'
+
+    def __init__(self, directory, compact_every=JOURNAL_COMPACT_EVERY):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.seq = 0
+        self.journal_records = 0
+        self._lock = threading.Lock()
+        self._journal = None
+        self.compactor = WriteBehindPersister(self._write_snapshot, delay=0)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        data = empty_data()
+        snapshot_seq = 0
+        if os.path.exists(self._path(self.SNAPSHOT)):
+            with open(self._path(self.SNAPSHOT), encoding='utf-8') as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot['seq']
+            data = snapshot['data']
+
+        self.seq = snapshot_seq
+        self.journal_records = 0
+        for name in (self.ROTATED_JOURNAL, self.JOURNAL):
+            if not os.path.exists(self._path(name)):
+                continue
+            with open(self._path(name), encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write, everything before it is intact
+                        break
+                    self.journal_records += 1
+                    if record['seq'] <= snapshot_seq:
+                        continue
+                    apply_mutation(data, record['mutation'])
+                    self.seq = record['seq']
+
+        if os.path.exists(self._path(self.ROTATED_JOURNAL)):
+            # Interrupted compaction, finish it before accepting new records
+            self._write_snapshot({'seq': self.seq, 'data': snapshot_data(data)})
+            if os.path.exists(self._path(self.JOURNAL)):
+                os.remove(self._path(self.JOURNAL))
+            self.journal_records = 0
+        return data
+
+    def append(self, mutation, data):
+        with self._lock:
+            self.seq += 1
+            line = json.dumps({'seq': self.seq, 'mutation': mutation}, ensure_ascii=False)
+            with self.timed('journal_append'):
+                if self._journal is None:
+                    self._journal = open(self._path(self.JOURNAL), 'a', encoding='utf-8')
+                self._journal.write(line + "\n")
+                self._journal.flush()
+            self.observe_size('journal_append', len(line) + 1)
+            self.journal_records += 1
+
+            if self.journal_records >= self.compact_every:
+                self._start_compaction(data)
+
+    def save(self, data):
+        with self._lock:
+            self._start_compaction(data)
+
+    def _start_compaction(self, data):
+        # Still busy with the previous compaction; the next append tries again
+        if self.compactor.status()['pending']:
+            return
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self._path(self.JOURNAL)):
+            os.replace(self._path(self.JOURNAL), self._path(self.ROTATED_JOURNAL))
+        self.journal_records = 0
+        self.compactor.submit({'seq': self.seq, 'data': snapshot_data(data)})
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = self._path(self.SNAPSHOT + '.tmp')
+        with self.timed('snapshot_write'), open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+            self.observe_size('snapshot_write', f.tell())
+        os.replace(tmp_path, self._path(self.SNAPSHOT))
+        # Everything in the rotated journal is part of the snapshot now
+        if os.path.exists(self._path(self.ROTATED_JOURNAL)):
+            os.remove(self._path(self.ROTATED_JOURNAL))
+
+    def flush(self, timeout=None):
+        return self.compactor.flush(timeout)
+
+    def status(self):
+        status = self.compactor.status()
+        status.update({'seq': self.seq, 'journal_records': self.journal_records})
+        return status
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Mutation log in a SQLite database shared by several worker processes.
+
+    Every write runs inside an immediate transaction, which makes the database
+    the single write authority: the writer first applies everything the other
+    workers appended since its last look, then appends its own mutation, so all
+    workers apply the same mutations in the same order. Readers of other
+    workers pick the new records up on their next request (or within
+    SYNC_INTERVAL) and apply them to their in-memory state as deltas.
+
+    Every `compact_every` records a snapshot is stored and older records are
+    dropped, keeping another `compact_every` records for workers lagging behind;
+    a worker that fell further behind reloads the snapshot.
+    """
+
+    shared = True
+    name = 'sqlite'
+
+    def __init__(self, path, compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self.seq = 0
+        self._local = threading.local()
+        self._depth = 0
+        self._appended = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS mutations (seq INTEGER PRIMARY KEY AUTOINCREMENT, mutation TEXT NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL, data TEXT NOT NULL)")
+        # Random per database, so sequence numbers of a recreated database don't match the old ones
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (os.urandom(4).hex(),))
+        self.epoch = connection.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+    def _connection(self):
+        # One connection per thread and process, connections must not cross a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def load(self):
+        connection = self._connection()
+        # Snapshot and records have to come from the same transaction
+        with self.timed('load'), nullcontext() if connection.in_transaction else self._transaction('BEGIN'):
+            row = connection.execute("SELECT seq, data FROM snapshot WHERE id = 1").fetchone()
+            seq, data = (row[0], json.loads(row[1])) if row else (0, empty_data())
+            for seq, mutation in connection.execute("SELECT seq, mutation FROM mutations WHERE seq > ? ORDER BY seq", (seq,)):
+                apply_mutation(data, json.loads(mutation))
+        self.seq = seq
+        return data
+
+    def has_changes(self):
+        row = self._connection().execute("SELECT MAX(seq) FROM mutations").fetchone()
+        return row[0] is not None and row[0] > self.seq
+
+    def catch_up(self, on_mutations, on_reload):
+        rows = self._connection().execute("SELECT seq, mutation FROM mutations WHERE seq > ? ORDER BY seq",
+                                          (self.seq,)).fetchall()
+        if not rows:
+            return
+        if rows[0][0] != self.seq + 1:
+            # The records in between were compacted away
+            on_reload(self.load())
+            return
+        self.seq = rows[-1][0]
+        on_mutations([json.loads(mutation) for _, mutation in rows])
+
+    @contextmanager
+    def transaction(self, on_mutations, on_reload):
+        if self._depth:
+            # Nested write (e.g. /purgeguests deleting players), already inside the transaction
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        self._depth = 1
+        self._appended = False
+        try:
+            self.catch_up(on_mutations, on_reload)
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            if self._appended:
+                # The in-memory state already has the change, get back to what the database has
+                on_reload(self.load())
+            raise
+        else:
+            connection.execute("COMMIT")
+        finally:
+            self._depth = 0
+
+    def append(self, mutation, data):
+        line = json.dumps(mutation, ensure_ascii=False)
+        with self.timed('append'):
+            cursor = self._connection().execute("INSERT INTO mutations (mutation) VALUES (?)", (line,))
+        self.observe_size('append', len(line))
+        self.seq = cursor.lastrowid
+        self._appended = True
+        if self.seq % self.compact_every == 0:
+            self._write_snapshot(data)
+
+    def save(self, data):
+        with nullcontext() if self._depth else self._transaction('BEGIN IMMEDIATE'):
+            self._write_snapshot(data)
+
+    @contextmanager
+    def _transaction(self, begin):
+        connection = self._connection()
+        connection.execute(begin)
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+
+    def _write_snapshot(self, data):
+        content = json.dumps(snapshot_data(data), ensure_ascii=False)
+        with self.timed('snapshot_write'):
+            connection = self._connection()
+            connection.execute("INSERT OR REPLACE INTO snapshot (id, seq, data) VALUES (1, ?, ?)", (self.seq, content))
+            connection.execute("DELETE FROM mutations WHERE seq <= ?", (self.seq - self.compact_every,))
+        self.observe_size('snapshot_write', len(content))
+
+    def version(self):
+        return self.epoch, self.seq
+
+    def status(self):
+        return {'seq': self.seq, 'epoch': self.epoch, 'path': self.path}
+
+
+def create_backend(name=STORAGE_BACKEND):
+    if name == 'journal':
+        return JournalBackend(JOURNAL_DIR)
+    if name == 'sqlite':
+        return SqliteBackend(SQLITE_PATH)
+    if name == 'gist':
+        return GistBackend(os.environ.get('GIST_ID'), os.environ.get('TOKEN'), os.environ.get('GIST_FILENAME'))
+    raise ValueError(f"Unknown storage backend '{name}'")
+
+backend = create_backend()
+load_stats = {}
+
+@atexit.register
+def flush_data(timeout=30):
+    return backend.flush(timeout)
+
+def persistence_status():
+    status = backend.status()
+    status['backend'] = type(backend).__name__
+    status['load'] = dict(load_stats)
+    return status
+
+def reconcile_data(on_reload, exclusive=nullcontext, max_backoff=SAVE_MAX_BACKOFF):
+    """
+    Reconciles with the remote, retrying until it succeeds. Newer data goes to
+    `on_reload`, called inside `exclusive` so no write can slip in between.
+    """
+    started = time.perf_counter()
+    backoff = 1
+    while True:
+        try:
+            changed = backend.reconcile(exclusive, on_reload)
+            break
+        except Exception as e:
+            logger.error("Error reconciling data: %s", e)
+            time.sleep(backoff)
+            backoff = min(max_backoff, backoff * 2)
+
+    metrics.observe('aixplay_storage_duration_seconds', time.perf_counter() - started,
+                    backend=backend.name, operation='reconcile')
+    load_stats['reconcile_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    load_stats['remote_changed'] = changed
+    print(f"Reconciled data with {type(backend).__name__} in {load_stats['reconcile_ms']} ms")
 
 def load_data():
+    """
+    Loads the data as fast as possible: from the local cache if there is one,
+    otherwise from the backend itself. Call start_reconcile() afterwards to sync
+    a remote backend in the background.
+    """
+    started = time.perf_counter()
+    source = 'local'
     try:
-        content = fetch_gist_content()
-        return yaml.safe_load(content)
+        data = backend.load_cached()
+        if data is None:
+            source = 'remote'
+            data = backend.load()
     except Exception as e:
-        return {"pinball_machines": [], "players": [], "scores": []}
+        logger.error("Error loading data: %s", e)
+        source = 'empty'
+        data = None
 
-def save_data(data):
-    try:
-        content = yaml.dump(data)
-        update_gist(content)
-    except Exception as e:
-        print(f"Error saving data: {e}")
\ No newline at end of file
+    metrics.observe('aixplay_storage_duration_seconds', time.perf_counter() - started,
+                    backend=backend.name, operation='startup_load')
+    load_stats.update({'source': source, 'load_ms': round((time.perf_counter() - started) * 1000, 1)})
+    print(f"Loaded data from {source} in {load_stats['load_ms']} ms")
+    return data or empty_data()
+
+def start_reconcile(on_reload, exclusive=nullcontext):
+    if backend.remote:
+        threading.Thread(target=reconcile_data, args=(on_reload, exclusive), name='reconcile', daemon=True).start()
+
+def has_changes():
+    return backend.has_changes()
+
+def storage_version():
+    return backend.version()
+
+def catch_up(on_mutations, on_reload):
+    backend.catch_up(on_mutations, on_reload)
+
+def write_transaction(on_mutations, on_reload):
+    return backend.transaction(on_mutations, on_reload)
+
+sync_worker = {'poll': None, 'pid': None}
+
+def start_sync(poll):
+    """Multi-worker mode: calls `poll` every SYNC_INTERVAL seconds so idle workers stay current too."""
+    if backend.shared:
+        sync_worker['poll'] = poll
+        ensure_sync()
+
+def ensure_sync():
+    # Threads don't survive a fork (gunicorn --preload), every worker process starts its own
+    if sync_worker['poll'] is None or sync_worker['pid'] == os.getpid():
+        return
+    sync_worker['pid'] = os.getpid()
+    threading.Thread(target=_sync_loop, args=(sync_worker['poll'],), name='sync', daemon=True).start()
+
+def _sync_loop(poll):
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        try:
+            poll()
+        except Exception as e:
+            logger.error("Error syncing data: %s", e)
+
+def save_data(data, mutation=None):
+    """Persists `data`; pass the mutation record if the backend can store just the change."""
+    if mutation is None:
+        backend.save(data)
+    else:
+        backend.append(mutation, data)
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+from collections import deque
+
+# How many past events are kept for clients that reconnect with a cursor
+EVENT_BUFFER_SIZE = 1000
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+
+
+class EventBus:
+    """
+    Change events for the Server-Sent Events stream.
+
+    Events get increasing ids and are kept in a ring buffer, so a client that
+    reconnects with its last id (the resume cursor) receives everything it
+    missed. Ids carry the epoch of the bus ("<epoch>-<n>"), a random value per
+    process: an id from another worker or from before a restart can't be
+    resumed from. If the cursor is unknown like that, ahead of this bus or fell
+    out of the buffer, the client gets a single 'reload' event instead and has
+    to refetch. All subscribers wait on one shared condition; nothing is done
+    per subscriber until an event is published.
+    """
+
+    def __init__(self, size=EVENT_BUFFER_SIZE, epoch=None):
+        self.events = deque(maxlen=size)
+        self.epoch = epoch or os.urandom(4).hex()
+        self.last_id = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def publish(self, event):
+        with self._condition:
+            self.last_id += 1
+            self.events.append((self.last_id, event))
+            self._condition.notify_all()
+            return self.last_id
+
+    def event_id(self, number):
+        return f"{self.epoch}-{number}"
+
+    def cursor(self, last_event_id):
+        """
+        Position of a client's Last-Event-ID in this bus: the current one for a new
+        client (no id), None for an id this bus can't resume from.
+        """
+        if not last_event_id:
+            return self.last_id
+        epoch, _, number = last_event_id.rpartition('-')
+        if epoch != self.epoch or not number.isdigit() or int(number) > self.last_id:
+            return None
+        return int(number)
+
+    def since(self, cursor):
+        """Events after `cursor`, or None if some of them are no longer buffered."""
+        with self._condition:
+            if cursor >= self.last_id:
+                return []
+            if not self.events or self.events[0][0] > cursor + 1:
+                return None
+            return [(event_id, event) for event_id, event in self.events if event_id > cursor]
+
+    def wait(self, cursor, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_id > cursor or self.closed, timeout)
+
+    def close(self):
+        """Ends all streams, e.g. on shutdown; the browsers reconnect to another worker."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def stream(self, last_event_id=None, heartbeat=HEARTBEAT_INTERVAL):
+        """Generator producing the text/event-stream body for one subscriber."""
+        cursor = self.cursor(last_event_id)
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+
+        if cursor is None:
+            # Whatever the client missed, this process can't tell it
+            cursor = self.last_id
+            yield self._format(cursor, {'op': 'reload'})
+
+        while not self.closed:
+            events = self.since(cursor)
+            if events is None:
+                events = [(self.last_id, {'op': 'reload'})]
+            for event_id, event in events:
+                yield self._format(event_id, event)
+                cursor = event_id
+            if not events:
+                yield ": keep-alive\n\n"
+            self.wait(cursor, heartbeat)
+
+    def _format(self, number, event):
+        return f"id: {self.event_id(number)}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
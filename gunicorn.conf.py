@@ -0,0 +1,62 @@
+# Production server: gunicorn -c gunicorn.conf.py api:app
+#
+# gevent workers: every connection is a greenlet, so an open /events stream or a
+# request waiting on GitHub costs no thread, and a handful of idle scoreboards
+# can't use up the workers. gevent patches the threads, locks and sockets of the
+# app to cooperate. With the Gist or journal backend the state lives in one
+# process, so keep a single worker there; STORAGE_BACKEND=sqlite allows more
+# (WEB_CONCURRENCY), the workers then share the data through the database.
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '3000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+# Connections per worker, open /events streams included
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '1000'))
+# Only for WORKER_CLASS=gthread (e.g. for PROFILE_SLOW_MS, the sampling profiler only sees
+# real threads): every open /events stream holds one of these threads there
+threads = int(os.environ.get('THREADS', '32'))
+timeout = int(os.environ.get('WORKER_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-' if os.environ.get('ACCESS_LOG') else None
+
+# /metrics adds up the values of all workers through this directory (see metrics.py); set
+# before the workers import the app, one per server run and removed on exit unless given
+metrics_dir = None
+if workers > 1 and not os.environ.get('METRICS_DIR'):
+    metrics_dir = os.environ['METRICS_DIR'] = os.path.join(tempfile.gettempdir(), f'aixplay-metrics-{os.getpid()}')
+
+
+def post_worker_init(worker):
+    # On SIGTERM end the /events streams first, the worker would wait for them until graceful_timeout
+    import signal
+    import api
+
+    handle_exit = worker.handle_exit
+
+    def close_streams(sig, frame):
+        api.events.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, close_streams)
+
+
+def worker_exit(server, worker):
+    # Write-behind uploads still pending go out before the process is gone
+    from data_manager import flush_data
+    flush_data()
+
+
+def child_exit(server, worker):
+    # The requests of a finished worker still count, its gauges don't
+    if os.environ.get('METRICS_DIR'):
+        from metrics import metrics
+        metrics.retire(worker.pid)
+
+
+def on_exit(server):
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,87 @@
+import datetime
+import functools
+import gzip
+import os
+import threading
+
+from flask import request, make_response
+
+# JSON bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+
+class DataVersion:
+    """
+    Version of the tournament data, advanced once per committed mutation.
+
+    By default `value` counts the mutations of this process and `epoch` is random
+    per process, so after a restart an old ETag can't match other data. A storage
+    backend shared by several processes provides its persisted (epoch, position)
+    instead (see sync()), which is the same in every worker holding the same data.
+    """
+
+    def __init__(self, epoch=None):
+        self.epoch = epoch or os.urandom(4).hex()
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def bump(self, count=1):
+        with self._lock:
+            self.value += count
+            return self.value
+
+    def sync(self, version):
+        """Takes over the (epoch, position) of the storage backend."""
+        with self._lock:
+            self.epoch, self.value = version
+
+    def tag(self):
+        return f"{self.epoch}.{self.value}"
+
+    def etag(self):
+        # Today's date is part of it, some views (latest scores, match suggestions) change at midnight
+        return f"{self.tag()}-{datetime.date.today().isoformat()}"
+
+
+def conditional(version):
+    """
+    Decorator for JSON read endpoints: answers a matching If-None-Match with
+    304 before the view runs, and tags every other response with an ETag
+    derived from the data version.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = version.etag()
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # Browsers may keep the body but have to revalidate it on every poll
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Data-Version'] = version.tag()
+            return response
+        return wrapper
+    return decorator
+
+
+def gzip_response(response):
+    """after_request hook compressing larger JSON bodies for clients that accept gzip."""
+    if (response.status_code != 200
+            or response.mimetype != 'application/json'
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.accept_encodings):
+        return response
+
+    body = response.get_data()
+    if len(body) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
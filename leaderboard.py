@@ -0,0 +1,354 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+class MachineBoard:
+    """
+    Best score per player for a single pinball machine, kept sorted.
+
+    Every player gets a sequence number on their first appearance, so players
+    with equal points keep the order in which they first scored on the machine
+    (the same order a stable sort over data['scores'] produces).
+    """
+
+    def __init__(self):
+        self.best = {}      # player_abbreviation -> (points, seq)
+        self.ranking = []   # sorted list of (-points, seq, player_abbreviation)
+        self.next_seq = 0
+
+    def add(self, player_abbreviation, points):
+        """Record a score. Returns True if the ranking changed."""
+        current = self.best.get(player_abbreviation)
+        if current is None:
+            seq = self.next_seq
+            self.next_seq += 1
+        elif current[0] < points:
+            seq = current[1]
+            self._discard(player_abbreviation, current)
+        else:
+            return False
+
+        self.best[player_abbreviation] = (points, seq)
+        insort(self.ranking, (-points, seq, player_abbreviation))
+        return True
+
+    def remove_player(self, player_abbreviation):
+        """Drop a player from the board. Returns True if the player was on it."""
+        current = self.best.pop(player_abbreviation, None)
+        if current is None:
+            return False
+        self._discard(player_abbreviation, current)
+        return True
+
+    def nth_best(self, index):
+        return -self.ranking[index][0]
+
+    def _discard(self, player_abbreviation, entry):
+        points, seq = entry
+        index = bisect_left(self.ranking, (-points, seq))
+        del self.ranking[index]
+
+    def __len__(self):
+        return len(self.ranking)
+
+
+class LeaderboardIndex:
+    """
+    In-memory leaderboard per pinball machine.
+
+    The index is updated on every mutation instead of rescanning data['scores'],
+    so reading a machine's highscores costs O(players on that machine).
+
+    The total standings are a materialized view on top of it: each machine's
+    ranking points are kept per player and only the machine touched by a write
+    is recomputed. `version` is bumped whenever the standings may have changed.
+    """
+
+    def __init__(self, data=None):
+        self.boards = {}          # pinball_abbreviation -> MachineBoard
+        self.guest_status = {}    # player_abbreviation -> guest flag
+        self.version = 0
+        self._highscores = {}     # pinball_abbreviation -> cached highscore list
+        self._entries = {}        # pinball_abbreviation -> {player_abbreviation: highscore entry}
+        self._non_guests = {}     # pinball_abbreviation -> non-guest count per ranking prefix
+        self._contributions = {}  # pinball_abbreviation -> {player_abbreviation: ranking points}
+        self._totals = {}         # player_abbreviation -> [total points, number of machines]
+        self._standings = None
+        if data is not None:
+            self.rebuild(data)
+
+    def rebuild(self, data):
+        self.boards = {}
+        self.guest_status = {player['abbreviation']: player.get('guest', False) for player in data['players']}
+        for score in data['scores']:
+            pinball_abbreviation = score['pinball_abbreviation']
+            board = self.boards.get(pinball_abbreviation)
+            if board is None:
+                board = self.boards[pinball_abbreviation] = MachineBoard()
+            board.add(score['player_abbreviation'], score_points(score))
+        self._recompute_all()
+
+    def update_players(self, players):
+        # Later entries win, just like a dict comprehension over data['players']
+        self.guest_status = {player['abbreviation']: player.get('guest', False) for player in players}
+        # Guest flags shift ranks and points on every machine the player is on
+        self._recompute_all()
+
+    def add_score(self, score):
+        pinball_abbreviation = score['pinball_abbreviation']
+        points = score_points(score)
+        board = self.boards.get(pinball_abbreviation)
+        if board is None:
+            board = self.boards[pinball_abbreviation] = MachineBoard()
+        if board.add(score['player_abbreviation'], points):
+            self._touch(pinball_abbreviation)
+
+    def rebuild_machine(self, pinball_abbreviation, machine_scores):
+        """
+        Rebuild a single machine from its remaining scores (in data order).
+
+        Used after a score was deleted, since the player's previous best (and
+        their first appearance on the machine) has to be looked up again.
+        """
+        board = MachineBoard()
+        for score in machine_scores:
+            board.add(score['player_abbreviation'], score['points'])
+
+        if board:
+            self.boards[pinball_abbreviation] = board
+        else:
+            self.boards.pop(pinball_abbreviation, None)
+        self._touch(pinball_abbreviation)
+
+    def remove_player(self, player_abbreviation):
+        for pinball_abbreviation, board in list(self.boards.items()):
+            if board.remove_player(player_abbreviation):
+                if not board:
+                    del self.boards[pinball_abbreviation]
+                self._touch(pinball_abbreviation)
+
+    def remove_many(self, machines, changed, players=None):
+        """
+        Batch delete: drops the boards of `machines`, rebuilds the boards in
+        `changed` (pinball_abbreviation -> remaining scores in data order) and takes
+        the new player list if one is given. Everything is re-ranked only once.
+        """
+        for pinball_abbreviation in machines:
+            self.boards.pop(pinball_abbreviation, None)
+        for pinball_abbreviation, machine_scores in changed.items():
+            board = MachineBoard()
+            for score in machine_scores:
+                board.add(score['player_abbreviation'], score['points'])
+            if board:
+                self.boards[pinball_abbreviation] = board
+            else:
+                self.boards.pop(pinball_abbreviation, None)
+
+        if players is not None:
+            self.guest_status = {player['abbreviation']: player.get('guest', False) for player in players}
+            self._recompute_all()
+        else:
+            for pinball_abbreviation in set(machines) | set(changed):
+                self._touch(pinball_abbreviation)
+
+    def remove_machine(self, pinball_abbreviation):
+        self.boards.pop(pinball_abbreviation, None)
+        self._touch(pinball_abbreviation)
+
+    def machines(self):
+        """Abbreviations of all machines that have at least one score."""
+        return list(self.boards)
+
+    def highscores(self, pinball_abbreviation):
+        cached = self._highscores.get(pinball_abbreviation)
+        if cached is None:
+            cached = self._highscores[pinball_abbreviation] = self._rank(pinball_abbreviation)
+        return cached
+
+    def entry(self, pinball_abbreviation, player_abbreviation):
+        """The highscore entry (rank, points, ...) of a player on a machine, or None."""
+        entries = self._entries.get(pinball_abbreviation)
+        if entries is None:
+            entries = self._entries[pinball_abbreviation] = {
+                score['player']: score for score in self.highscores(pinball_abbreviation)
+            }
+        return entries.get(player_abbreviation)
+
+    def overview(self, pinball_abbreviation, player_abbreviation):
+        """
+        Best score of the machine, the score needed for the 15-point zone (the 15th
+        best, or the lowest if there are fewer) and the player's personal best.
+        """
+        board = self.boards.get(pinball_abbreviation)
+        if board is None:
+            return {'minScore': None, 'maxScore': None, 'playerScore': None}
+
+        player_best = board.best.get(player_abbreviation)
+        return {
+            'minScore': board.nth_best(14) if len(board) > 15 else board.nth_best(-1),
+            'maxScore': board.nth_best(0),
+            'playerScore': player_best[0] if player_best else None
+        }
+
+    def preview(self, pinball_abbreviation, player_abbreviation, points):
+        """
+        Rank and ranking points `points` would get on a machine if it were the
+        player's best score there, following the rules of highscores().
+        """
+        preview = self.overview(pinball_abbreviation, player_abbreviation)
+        preview.update({'score': points, 'rank': 1, 'points': 15, 'personalBest': True})
+        board = self.boards.get(pinball_abbreviation)
+        if board is None:
+            return preview
+
+        # Guests don't take up ranks or points, so only non-guests ahead count
+        non_guests = self._non_guest_prefix(pinball_abbreviation)
+        own = board.best.get(player_abbreviation)
+        own_index = bisect_left(board.ranking, (-own[0], own[1])) if own else None
+
+        def non_guests_before(index):
+            count = non_guests[index]
+            if own_index is not None and own_index < index and not self.guest_status.get(player_abbreviation, False):
+                count -= 1
+            return count
+
+        # Equal scores share the rank, but a new score is listed after the existing ones
+        above = bisect_left(board.ranking, (-points,))
+        at_least = bisect_right(board.ranking, (-points, float('inf')))
+        preview['rank'] = 1 + non_guests_before(above)
+        ahead = non_guests_before(at_least)
+        preview['points'] = 15 - ahead if ahead < 15 else 0
+        preview['personalBest'] = own is None or own[0] < points
+        return preview
+
+    def _non_guest_prefix(self, pinball_abbreviation):
+        prefix = self._non_guests.get(pinball_abbreviation)
+        if prefix is None:
+            prefix = [0]
+            for _, _, player_abbreviation in self.boards[pinball_abbreviation].ranking:
+                prefix.append(prefix[-1] + (0 if self.guest_status.get(player_abbreviation, False) else 1))
+            self._non_guests[pinball_abbreviation] = prefix
+        return prefix
+
+    def total_standings(self):
+        """Overall ranking over all machines, rebuilt only after a change."""
+        if self._standings is None:
+            self._standings = standings(self._totals)
+        return self._standings
+
+    def _touch(self, pinball_abbreviation):
+        """Re-rank a single machine and apply the difference to the totals."""
+        self._highscores.pop(pinball_abbreviation, None)
+        self._entries.pop(pinball_abbreviation, None)
+        self._non_guests.pop(pinball_abbreviation, None)
+
+        for player, points in self._contributions.pop(pinball_abbreviation, {}).items():
+            total = self._totals[player]
+            total[0] -= points
+            total[1] -= 1
+            if not total[1]:
+                del self._totals[player]
+
+        if pinball_abbreviation in self.boards:
+            contribution = {}
+            for score in self.highscores(pinball_abbreviation):
+                contribution[score['player']] = score['points']
+                total = self._totals.setdefault(score['player'], [0, 0])
+                total[0] += score['points']
+                total[1] += 1
+            self._contributions[pinball_abbreviation] = contribution
+
+        self._standings = None
+        self.version += 1
+
+    def _recompute_all(self):
+        self._highscores = {}
+        self._entries = {}
+        self._non_guests = {}
+        self._contributions = {}
+        self._totals = {}
+        for pinball_abbreviation in self.boards:
+            self._touch(pinball_abbreviation)
+        self._standings = None
+        self.version += 1
+
+    def position(self, pinball_abbreviation, player_abbreviation):
+        """1-based position of the player in highscores() (guests included, ties not shared), or None."""
+        board = self.boards.get(pinball_abbreviation)
+        best = board.best.get(player_abbreviation) if board is not None else None
+        if best is None:
+            return None
+        return bisect_left(board.ranking, (-best[0], best[1])) + 1
+
+    def _rank(self, pinball_abbreviation):
+        board = self.boards.get(pinball_abbreviation)
+        if board is None:
+            return []
+        return rank_board(board.ranking, self.guest_status)
+
+
+def score_points(score):
+    """
+    The points of a score entering the index. The boards sort by them, so anything
+    but an int is refused here instead of failing halfway through a board.
+    """
+    points = score['points']
+    if isinstance(points, bool) or not isinstance(points, int):
+        raise ValueError(f"Invalid points '{points}' on {score['pinball_abbreviation']}, expected a whole number")
+    return points
+
+
+def rank_board(ranking, guest_status):
+    """Highscore entries with rank and ranking points for a MachineBoard.ranking-like list."""
+    # Assign ranking points, ensuring players with the same points get the same rank
+    highscores_with_rank_and_points = []
+    points = 15
+    rank = 1
+    previous_points = None
+    previous_rank = 1  # Keep track of the previous rank to ensure correct rank sharing
+
+    for negative_points, _, player_abbreviation in ranking:
+        score_points = -negative_points
+        is_guest = guest_status.get(player_abbreviation, False)
+
+        # If the current player's points are different from the previous player's points, update the rank
+        if previous_points is not None and score_points != previous_points:
+            previous_rank = rank  # Update previous rank to the current rank
+
+        # Ensure players ranked lower than 15 receive 0 points
+        assigned_points = points if rank <= 15 else 0
+
+        score_entry = {
+            'player': player_abbreviation,
+            'score': score_points,
+            'rank': previous_rank,
+            'points': assigned_points
+        }
+
+        if is_guest:
+            score_entry['guest'] = True
+
+        highscores_with_rank_and_points.append(score_entry)
+
+        previous_points = score_points
+        if not is_guest:
+            rank += 1
+
+        # Only decrement points if the player is not a guest and rank is within the top 15
+        if not is_guest and rank <= 15:
+            points -= 1 if points > 1 else 0
+
+    return highscores_with_rank_and_points
+
+
+def standings(totals):
+    """Overall ranking from {player: [total points, ...]}, in the format of total_standings()."""
+    # Ties by abbreviation, so the order doesn't depend on the order of the changes
+    sorted_scores = sorted(totals.items(), key=lambda x: (-x[1][0], x[0]))
+    return [
+        {
+            'rank': rank,
+            'player': player,
+            'total_points': total[0]
+        }
+        for rank, (player, total) in enumerate(sorted_scores, start=1)
+    ]
@@ -0,0 +1,226 @@
+"""
+Load test of the serving modes over real HTTP.
+
+Starts the app on a synthetic tournament (throwaway journal or SQLite data,
+no Gist access) once per mode, drives it with concurrent clients for a fixed
+time and reports throughput and latency percentiles:
+
+    python loadtest.py                               # flask run vs. gunicorn
+    python loadtest.py --modes gunicorn gunicorn-gthread --streams 64
+    python loadtest.py --modes gunicorn gunicorn-sqlite --clients 64
+    python loadtest.py --save loadtest.json
+
+By default more /events streams are held open than a gthread worker has
+threads (THREADS, 32), like the big screens and phones of a busy evening.
+
+Modes:
+    flask             the Flask development server (`flask run`), what the image used to start
+    gunicorn          gunicorn.conf.py: one gevent worker
+    gunicorn-gthread  gunicorn.conf.py with WORKER_CLASS=gthread: one worker with a thread pool
+    gunicorn-sqlite   gunicorn.conf.py with STORAGE_BACKEND=sqlite and --workers gevent worker processes
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmark import generate_data, endpoints, percentile
+
+MODES = ('flask', 'gunicorn', 'gunicorn-gthread', 'gunicorn-sqlite')
+# A request taking longer than this counts as an error
+REQUEST_TIMEOUT = 10
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, data, directory, port, workers):
+    """Starts the app in `mode` on `port` as a subprocess, serving `data`."""
+    env = dict(os.environ, PORT=str(port), PYTHONUNBUFFERED='1')
+    env.pop('GIST_ID', None)
+    if mode == 'gunicorn-sqlite':
+        from data_manager import SqliteBackend
+        path = os.path.join(directory, 'aixplay.sqlite3')
+        SqliteBackend(path).save(data)
+        env.update(STORAGE_BACKEND='sqlite', SQLITE_PATH=path, WEB_CONCURRENCY=str(workers))
+    else:
+        with open(os.path.join(directory, 'snapshot.json'), 'w') as f:
+            json.dump({'seq': 0, 'data': data}, f)
+        env.update(STORAGE_BACKEND='journal', JOURNAL_DIR=directory)
+    if mode == 'gunicorn-gthread':
+        env['WORKER_CLASS'] = 'gthread'
+
+    if mode == 'flask':
+        command = [sys.executable, '-m', 'flask', '--app', 'api', 'run', '--port', str(port)]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'api:app']
+    log = open(os.path.join(directory, f'{mode}.log'), 'w')
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} exited, see {log.name}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/players', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} did not start within 30 s, see {log.name}')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def hold_streams(base, count, stop, timeout=REQUEST_TIMEOUT):
+    """
+    Keeps `count` /events streams open, like the big screens and phones of an
+    evening. Returns how many of them the server accepted within `timeout`.
+    """
+    connected = threading.Semaphore(0)
+
+    def listen():
+        try:
+            with requests.get(f'{base}/events', stream=True, timeout=(5, 60)) as response:
+                for index, _ in enumerate(response.iter_content(chunk_size=None)):
+                    if index == 0:
+                        connected.release()
+                    if stop.is_set():
+                        break
+        except requests.RequestException:
+            pass
+
+    for _ in range(count):
+        threading.Thread(target=listen, daemon=True).start()
+    deadline = time.monotonic() + timeout
+    return sum(connected.acquire(timeout=max(deadline - time.monotonic(), 0)) for _ in range(count))
+
+
+def drive(base, requests_mix, clients, duration, write_every, write_body, seed=0):
+    """Runs `clients` threads for `duration` seconds. Returns latencies in ms and the error count."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        own = []
+        failed = 0
+        count = 0
+        while time.perf_counter() < stop_at:
+            count += 1
+            if write_every and count % write_every == 0:
+                method, url, body = 'POST', '/score', dict(write_body, points=rng.randrange(1, 10 ** 6) * 10)
+            else:
+                _, method, url, body = rng.choice(requests_mix)
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base + url, json=body, timeout=REQUEST_TIMEOUT)
+                response.content
+                if response.status_code >= 400:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            own.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def run_mode(mode, data, args):
+    directory = tempfile.mkdtemp(prefix=f'aixplay-loadtest-{mode}-')
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    requests_mix = [request for request in endpoints(data) if request[1] == 'GET']
+    write_body = next(body for name, method, url, body in endpoints(data) if name == 'add_score')
+
+    process = start_server(mode, data, directory, port, args.workers)
+    stop = threading.Event()
+    try:
+        streams = hold_streams(base, args.streams, stop)
+        drive(base, requests_mix, args.clients, args.warmup, 0, None)
+        started = time.perf_counter()
+        latencies, errors = drive(base, requests_mix, args.clients, args.duration, args.write_every, write_body)
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        stop_server(process)
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'streams': streams,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2) if latencies else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the serving modes')
+    parser.add_argument('--modes', nargs='*', choices=MODES, default=['flask', 'gunicorn'])
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--machines', type=int, default=30)
+    parser.add_argument('--scores', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--streams', type=int, default=40,
+                        help='/events streams kept open during the test, default above the gthread THREADS')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per mode')
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--write-every', type=int, default=20, help='every Nth request of a client is a POST /score')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes for gunicorn-sqlite')
+    parser.add_argument('--keep', action='store_true', help='keep the data directories and server logs')
+    parser.add_argument('--save', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    data = generate_data(args.players, args.machines, args.scores)
+    report = {'clients': args.clients, 'streams': args.streams, 'duration_s': args.duration, 'modes': {}}
+    print(f"{'mode':<18}{'streams':>8}{'requests':>10}{'errors':>8}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for mode in args.modes:
+        result = report['modes'][mode] = run_mode(mode, data, args)
+        print(f"{mode:<18}{result['streams']:>8}{result['requests']:>10}{result['errors']:>8}{result['throughput_rps']:>10.1f}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
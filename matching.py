@@ -0,0 +1,144 @@
+import random
+import time
+
+# A player is never suggested for more than this many machines at once
+MAX_SUGGESTIONS = 2
+
+
+def suggest_matches(unplayed, machines, max_suggestions=MAX_SUGGESTIONS):
+    """
+    Pairs players on machines neither of them has played yet.
+
+    `unplayed` maps each active player to the bitset of machines they haven't
+    played, `machines` maps the machines that may be used to their bit. Every
+    machine gets two players or none, no player gets more than
+    `max_suggestions` machines.
+
+    This is a b-matching between machine slots and players: machines are filled
+    one at a time (the ones with the fewest candidates first), each slot through
+    an augmenting path that may move already placed players to another of their
+    candidate machines to make room. A machine whose second slot can't be filled
+    gives its first one back. Free players with the fewest suggestions are taken
+    first, so the machines are spread over as many players as possible.
+
+    Returns a list of (machine, player1, player2), in the order of `machines`.
+    """
+    candidates = {}
+    for machine, bit in machines.items():
+        players = [player for player, mask in unplayed.items() if mask >> bit & 1]
+        if len(players) >= 2:
+            candidates[machine] = players
+
+    schedule = _Schedule(candidates, max_suggestions)
+    for machine in sorted(candidates, key=lambda machine: len(candidates[machine])):
+        schedule.fill(machine)
+
+    order = {machine: index for index, machine in enumerate(machines)}
+    return [(machine, *players) for machine, players in sorted(schedule.assigned.items(), key=lambda item: order[item[0]])
+            if len(players) == 2]
+
+
+class _Schedule:
+    def __init__(self, candidates, max_suggestions):
+        self.candidates = candidates
+        self.max_suggestions = max_suggestions
+        self.assigned = {}  # machine -> [player]
+        self.load = {}      # player -> [machine]
+        self.undo = []
+
+    def fill(self, machine):
+        self.undo = []
+        if self._augment(machine) and self._augment(machine):
+            return True
+        # Only one slot found, put back whoever was moved for it
+        for op, player, target in reversed(self.undo):
+            if op == 'add':
+                self._remove(player, target)
+            else:
+                self._add(player, target)
+        return False
+
+    def _augment(self, machine):
+        # Shortcut: a free candidate, the one with the fewest suggestions so far
+        free = None
+        for player in self.candidates[machine]:
+            machines = self.load.get(player, ())
+            if len(machines) < self.max_suggestions and machine not in machines:
+                if not machines:
+                    free = player
+                    break
+                if free is None:
+                    free = player
+        if free is not None:
+            self._log_add(free, machine)
+            return True
+
+        # Breadth-first search for a chain: a candidate of `machine` moves over from a
+        # machine of theirs, which takes another candidate instead, ... until someone is free
+        parent = {machine: None}
+        seen = set()
+        queue = [machine]
+        for current in queue:
+            assigned = self.assigned.get(current, ())
+            for player in self.candidates[current]:
+                if player in seen or player in assigned:
+                    continue
+                seen.add(player)
+                machines = self.load.get(player, ())
+                if len(machines) < self.max_suggestions:
+                    self._apply(parent, current, player)
+                    return True
+                for other in machines:
+                    if other not in parent:
+                        parent[other] = (current, player)
+                        queue.append(other)
+        return False
+
+    def _apply(self, parent, machine, player):
+        self._log_add(player, machine)
+        while parent[machine] is not None:
+            previous, moved = parent[machine]
+            self._log_remove(moved, machine)
+            self._log_add(moved, previous)
+            machine = previous
+
+    def _log_add(self, player, machine):
+        self._add(player, machine)
+        self.undo.append(('add', player, machine))
+
+    def _log_remove(self, player, machine):
+        self._remove(player, machine)
+        self.undo.append(('remove', player, machine))
+
+    def _add(self, player, machine):
+        self.assigned.setdefault(machine, []).append(player)
+        self.load.setdefault(player, []).append(machine)
+
+    def _remove(self, player, machine):
+        self.assigned[machine].remove(player)
+        self.load[player].remove(machine)
+
+
+def benchmark(players=120, machines=60, played=0.4, rounds=20, seed=0):
+    """Times suggest_matches on a synthetic evening, returns (milliseconds per run, number of matches)."""
+    rng = random.Random(seed)
+    machine_bits = {f'M{bit}': bit for bit in range(machines)}
+    all_machines = (1 << machines) - 1
+    unplayed = {}
+    for index in range(players):
+        played_mask = 0
+        for bit in range(machines):
+            if rng.random() < played:
+                played_mask |= 1 << bit
+        unplayed[f'P{index}'] = all_machines & ~played_mask
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        matches = suggest_matches(unplayed, machine_bits)
+    return (time.perf_counter() - start) * 1000 / rounds, len(matches)
+
+
+if __name__ == '__main__':
+    for players, machines, played in ((20, 10, 0.5), (120, 60, 0.4), (200, 80, 0.9), (300, 100, 0.97)):
+        elapsed, matches = benchmark(players, machines, played)
+        print(f"{players} players, {machines} machines, {played:.0%} played: {matches} matches in {elapsed:.2f} ms")
@@ -0,0 +1,359 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Opt-in sampling profiler: requests slower than this many milliseconds get their
+# samples written as collapsed stacks (flamegraph.pl / speedscope format) into PROFILE_DIR
+PROFILE_SLOW_MS = float(os.environ['PROFILE_SLOW_MS']) if os.environ.get('PROFILE_SLOW_MS') else None
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'data/profiles')
+
+# Directory shared by the worker processes (WEB_CONCURRENCY > 1, gunicorn.conf.py sets it):
+# every process exports its counters and histograms there and /metrics adds them all up.
+# Without it each worker only reports what it handled itself.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Seconds between exports of a process that handled requests
+METRICS_EXPORT_INTERVAL = float(os.environ.get('METRICS_EXPORT_INTERVAL', '1'))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+DESCRIPTIONS = {
+    'aixplay_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'aixplay_http_request_duration_seconds': ('histogram', 'HTTP request latency by route and method'),
+    'aixplay_http_requests_in_flight': ('gauge', 'HTTP requests currently being handled'),
+    'aixplay_storage_duration_seconds': ('histogram', 'Time spent in storage operations'),
+    'aixplay_storage_payload_bytes': ('histogram', 'Size of the data read or written by storage operations'),
+    'aixplay_profiles_written_total': ('counter', 'Slow request profiles written to PROFILE_DIR'),
+    'aixplay_scores': ('gauge', 'Scores in the data set'),
+    'aixplay_players': ('gauge', 'Players in the data set'),
+    'aixplay_pinball_machines': ('gauge', 'Pinball machines in the data set'),
+    'aixplay_data_version': ('gauge', 'Version counter of the data, bumped by every change'),
+    'aixplay_storage_pending_mutations': ('gauge', 'Mutations not yet written by the storage backend'),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms with labels, rendered in the Prometheus text format.
+
+    Gauges may be set to a callable, which is evaluated at render time.
+
+    With a `directory` the values of all processes sharing it are added up:
+    every process exports its counters, histograms and plain gauges there as
+    <pid>.json (at most every METRICS_EXPORT_INTERVAL seconds). Callable gauges
+    (the size of the data set, ...) are the same in every worker and only come
+    from the rendering process.
+    """
+
+    def __init__(self, directory=METRICS_DIR, export_interval=METRICS_EXPORT_INTERVAL):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.gauges = {}      # (name, labels) -> value or callable
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.directory = directory
+        self.export_interval = export_interval
+        self._dirty = threading.Event()
+        self._export_lock = threading.Lock()
+        self._exporter_pid = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._changed()
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+        self._changed()
+
+    def add(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+        self._changed()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+        self._changed()
+
+    def _changed(self):
+        if self.directory is None:
+            return
+        self._dirty.set()
+        # Threads don't survive a fork, every worker process starts its own exporter
+        if self._exporter_pid != os.getpid():
+            self._exporter_pid = os.getpid()
+            threading.Thread(target=self._export_loop, name='metrics-export', daemon=True).start()
+
+    def _export_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.export_interval)
+            self._dirty.clear()
+            try:
+                self.export()
+            except OSError as e:
+                print(f"Error exporting metrics: {e}")
+
+    def _snapshot(self):
+        with self._lock:
+            return (dict(self.counters), dict(self.gauges),
+                    {key: (list(h.buckets), list(h.counts), h.sum, h.count) for key, h in self.histograms.items()})
+
+    def export(self):
+        """Writes the values of this process to the shared directory."""
+        counters, gauges, histograms = self._snapshot()
+        content = json.dumps({
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in gauges.items() if not callable(value)],
+            'histograms': [[name, labels, *values] for (name, labels), values in histograms.items()],
+        })
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._export_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+
+    def retire(self, pid):
+        """For a process that exited: keeps its counters and histograms, drops its gauges (requests in flight, ...)."""
+        path = os.path.join(self.directory, f"{pid}.json")
+        try:
+            with open(path, encoding='utf-8') as f:
+                exported = json.load(f)
+        except (OSError, ValueError):
+            return
+        exported['gauges'] = []
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(exported, f)
+        os.replace(path + '.tmp', path)
+
+    def _collect(self):
+        """Values of this process, plus those the other processes exported if there is a directory."""
+        counters, gauges, histograms = self._snapshot()
+        if self.directory is None:
+            return counters, gauges, histograms
+
+        own = os.path.join(self.directory, f"{os.getpid()}.json")
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path, encoding='utf-8') as f:
+                    exported = json.load(f)
+            except (OSError, ValueError):
+                # Gone or being replaced, the next scrape gets it
+                continue
+            for name, labels, value in exported['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in exported['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                if not callable(gauges.get(key)):
+                    gauges[key] = gauges.get(key, 0) + value
+            for name, labels, buckets, counts, total, count in exported['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                current = histograms.get(key)
+                if current is None:
+                    histograms[key] = (buckets, counts, total, count)
+                elif current[0] == buckets:
+                    histograms[key] = (buckets, [a + b for a, b in zip(current[1], counts)],
+                                       current[2] + total, current[3] + count)
+        return counters, gauges, histograms
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Observes the duration of the block in seconds, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        counters, gauges, histograms = self._collect()
+
+        lines = []
+        if self.directory is None:
+            lines.append(f"# Values of worker process {os.getpid()} only, set METRICS_DIR to add up all workers")
+        described = set()
+
+        def describe(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, text = DESCRIPTIONS.get(name, (default_type, None))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append(f"{name}{_format(labels)} {_number(value)}")
+        for (name, labels), value in sorted(gauges.items(), key=lambda item: item[0]):
+            describe(name, 'gauge')
+            lines.append(f"{name}{_format(labels)} {_number(value() if callable(value) else value)}")
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_format(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads handling requests every `interval` seconds.
+
+    Only runs while at least one request is being profiled. A request that takes
+    longer than `threshold` seconds gets its samples written as collapsed stacks,
+    one "frame;frame;frame count" line per distinct stack.
+    """
+
+    def __init__(self, threshold, interval, directory):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self._samples = {}  # thread id -> Counter of stacks
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+            self._lock.notify_all()
+
+    def stop(self, duration, name):
+        """Ends profiling of the current thread, returns the path of the written profile or None."""
+        with self._lock:
+            samples = self._samples.pop(threading.get_ident(), None)
+        if not samples or duration < self.threshold:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() else '_' for c in name).strip('_') or 'request'
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{safe_name}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._samples:
+                    self._lock.wait()
+                thread_ids = list(self._samples)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    samples = self._samples.get(thread_id)
+                    if samples is not None:
+                        samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+
+metrics = Metrics()
+profiler = SamplingProfiler(PROFILE_SLOW_MS / 1000, PROFILE_INTERVAL_MS / 1000, PROFILE_DIR) \
+    if PROFILE_SLOW_MS is not None else None
+
+
+def instrument(app, registry=metrics):
+    """
+    Records count, latency and in-flight requests of every route of `app`.
+
+    Register it before other after_request hooks (like gzip_response), those run
+    in reverse order and should be part of the measured time.
+    """
+    registry.set('aixplay_http_requests_in_flight', 0)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_in_flight = True
+        registry.add('aixplay_http_requests_in_flight', 1)
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        registry.inc('aixplay_http_requests_total', route=route, method=request.method,
+                     status=str(response.status_code))
+        registry.observe('aixplay_http_request_duration_seconds', duration, route=route, method=request.method)
+        if profiler is not None and profiler.stop(duration, f"{request.method} {route}"):
+            registry.inc('aixplay_profiles_written_total')
+        return response
+
+    @app.teardown_request
+    def end_request(exception=None):
+        if g.pop('metrics_in_flight', False):
+            registry.add('aixplay_http_requests_in_flight', -1)
+        if profiler is not None:
+            profiler.stop(0, '')
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def _format(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
@@ -1,19 +1,33 @@
-
 class PinballMachine:
+    __slots__ = ('long_name', 'abbreviation', 'room')
+
     def __init__(self, long_name, abbreviation, room):
         self.long_name = long_name
         self.abbreviation = abbreviation
         self.room = room
 
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
 class Player:
+    __slots__ = ('name', 'abbreviation', 'guest')
+
     def __init__(self, name, abbreviation=None, guest=None):
         self.name = name
         self.abbreviation = abbreviation
         self.guest = guest
 
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
 class Score:
+    __slots__ = ('player_abbreviation', 'pinball_abbreviation', 'points', 'date')
+
     def __init__(self, player_abbreviation, pinball_abbreviation, points, date):
         self.player_abbreviation = player_abbreviation
         self.pinball_abbreviation = pinball_abbreviation
         self.points = points
         self.date = date
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
@@ -0,0 +1,136 @@
+class PlayerStats:
+    """Counters for a single player, maintained score by score."""
+
+    def __init__(self):
+        self.machines = {}    # pinball_abbreviation -> number of scores
+        self.dates = {}       # date -> number of scores
+        self.played_mask = 0  # bitset over PlayerStatsIndex.machine_bits
+
+
+class PlayerStatsIndex:
+    """
+    Per-player statistics for /get_player and the match suggestions.
+
+    Played machines and unique play dates are reference counted, so deleting a
+    score only has to decrement them. The machines of the tournament are
+    numbered, which makes the played/unplayed sets of a player plain integer
+    bitsets that can be intersected cheaply.
+    """
+
+    def __init__(self, data=None):
+        self.players = {}          # player_abbreviation -> player dict
+        self.stats = {}            # player_abbreviation -> PlayerStats
+        self.players_by_date = {}  # date -> {player_abbreviation: number of scores}
+        self.machine_bits = {}     # pinball_abbreviation -> bit
+        self.all_machines_mask = 0
+        self._next_bit = 0
+        if data is not None:
+            self.rebuild(data)
+
+    def rebuild(self, data):
+        self.stats = {}
+        self.players_by_date = {}
+        self.machine_bits = {}
+        self.all_machines_mask = 0
+        self._next_bit = 0
+        self.update_players(data['players'])
+        self.update_machines(data['pinball_machines'])
+        for score in data['scores']:
+            self.add_score(score)
+
+    def update_players(self, players):
+        # The first entry wins, like the lookup in get_player always did
+        self.players = {}
+        for player in players:
+            self.players.setdefault(player['abbreviation'], player)
+
+    def update_machines(self, machines):
+        abbreviations = {machine['abbreviation'] for machine in machines}
+        for abbreviation in list(self.machine_bits):
+            if abbreviation not in abbreviations:
+                del self.machine_bits[abbreviation]
+        for abbreviation in abbreviations:
+            if abbreviation not in self.machine_bits:
+                self.machine_bits[abbreviation] = self._next_bit
+                self._next_bit += 1
+
+        self.all_machines_mask = 0
+        for bit in self.machine_bits.values():
+            self.all_machines_mask |= 1 << bit
+        for stats in self.stats.values():
+            stats.played_mask = self.mask(stats.machines)
+
+    def mask(self, machines):
+        mask = 0
+        for machine in machines:
+            bit = self.machine_bits.get(machine)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def machines_in(self, mask):
+        return [machine for machine, bit in self.machine_bits.items() if mask >> bit & 1]
+
+    def add_score(self, score):
+        player = score['player_abbreviation']
+        machine = score['pinball_abbreviation']
+        stats = self.stats.get(player)
+        if stats is None:
+            stats = self.stats[player] = PlayerStats()
+
+        stats.machines[machine] = stats.machines.get(machine, 0) + 1
+        stats.dates[score['date']] = stats.dates.get(score['date'], 0) + 1
+        stats.played_mask |= self.mask((machine,))
+
+        players = self.players_by_date.setdefault(score['date'], {})
+        players[player] = players.get(player, 0) + 1
+
+    def remove_score(self, score):
+        player = score['player_abbreviation']
+        machine = score['pinball_abbreviation']
+        stats = self.stats.get(player)
+        if stats is None:
+            return
+
+        if _decrement(stats.machines, machine):
+            stats.played_mask &= ~self.mask((machine,))
+        _decrement(stats.dates, score['date'])
+        players = self.players_by_date.get(score['date'])
+        if players is not None and _decrement(players, player) and not players:
+            del self.players_by_date[score['date']]
+        if not stats.machines:
+            del self.stats[player]
+
+    def remove_player(self, player_abbreviation):
+        stats = self.stats.pop(player_abbreviation, None)
+        if stats is None:
+            return
+        for date in stats.dates:
+            players = self.players_by_date[date]
+            del players[player_abbreviation]
+            if not players:
+                del self.players_by_date[date]
+
+    def active_players(self, date):
+        """Players with at least one score on `date`."""
+        return list(self.players_by_date.get(date, ()))
+
+    def unplayed_mask(self, player_abbreviation):
+        stats = self.stats.get(player_abbreviation)
+        played_mask = stats.played_mask if stats is not None else 0
+        return self.all_machines_mask & ~played_mask
+
+    def get(self, player_abbreviation):
+        return self.stats.get(player_abbreviation) or PlayerStats()
+
+
+def _decrement(counts, key):
+    """Decrements a reference count. Returns True if the key is gone afterwards."""
+    count = counts.get(key)
+    if count is None:
+        return False
+    if count > 1:
+        counts[key] = count - 1
+        return False
+    del counts[key]
+    return True
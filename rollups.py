@@ -0,0 +1,133 @@
+from bisect import bisect_left, bisect_right, insort
+
+from leaderboard import rank_board, standings
+from score_index import normalize_date
+
+
+class DailyRollup:
+    """
+    Best score per day, machine and player, the building block of the
+    per-day and date-range leaderboards.
+
+    A new score only touches its own day. Every score gets a sequence number in
+    data order; a day keeps the one of the player's first score on the machine,
+    so merging days gives equal points the same order a MachineBoard built from
+    the scores of that window would.
+    """
+
+    def __init__(self, scores=None):
+        self.days = {}      # normalized date -> {pinball_abbreviation: {player_abbreviation: (points, seq)}}
+        self.dates = []     # sorted keys of days
+        self.sequence = {}  # id(score) -> seq
+        self.next_seq = 0
+        if scores is not None:
+            self.rebuild(scores)
+
+    def rebuild(self, scores):
+        self.days = {}
+        self.dates = []
+        self.sequence = {}
+        self.next_seq = 0
+        for score in scores:
+            self.add(score)
+
+    def add(self, score):
+        seq = self.sequence[id(score)] = self.next_seq
+        self.next_seq += 1
+
+        date = normalize_date(score['date'])
+        day = self.days.get(date)
+        if day is None:
+            day = self.days[date] = {}
+            insort(self.dates, date)
+        best = day.setdefault(score['pinball_abbreviation'], {})
+        current = best.get(score['player_abbreviation'])
+        if current is None:
+            best[score['player_abbreviation']] = (score['points'], seq)
+        elif current[0] < score['points']:
+            best[score['player_abbreviation']] = (score['points'], current[1])
+
+    def remove(self, score, day_scores):
+        """Drops a score; `day_scores` are the scores left on its day (ScoreIndex.date), in data order."""
+        self.sequence.pop(id(score), None)
+        self._recompute(normalize_date(score['date']), score['pinball_abbreviation'], day_scores)
+
+    def remove_many(self, scores, day_scores):
+        """Drops a batch of scores; `day_scores(date)` gives the scores left on a day."""
+        for score in scores:
+            self.sequence.pop(id(score), None)
+        for date, machine in {(normalize_date(score['date']), score['pinball_abbreviation']) for score in scores}:
+            self._recompute(date, machine, day_scores(date))
+
+    def _recompute(self, date, machine, day_scores):
+        day = self.days.get(date)
+        if day is None:
+            return
+        best = {}
+        for other in day_scores:
+            if other['pinball_abbreviation'] != machine:
+                continue
+            current = best.get(other['player_abbreviation'])
+            if current is None:
+                best[other['player_abbreviation']] = (other['points'], self.sequence[id(other)])
+            elif current[0] < other['points']:
+                best[other['player_abbreviation']] = (other['points'], current[1])
+        if best:
+            day[machine] = best
+        else:
+            day.pop(machine, None)
+            self._drop_empty(date)
+
+    def remove_scores(self, scores, key, value):
+        """Drops the removed scores of a player (key 'player') or machine (key 'machine') at once."""
+        for score in scores:
+            self.sequence.pop(id(score), None)
+        for date in {normalize_date(score['date']) for score in scores}:
+            day = self.days.get(date)
+            if day is None:
+                continue
+            if key == 'machine':
+                day.pop(value, None)
+            else:
+                for machine in [machine for machine, best in day.items() if value in best]:
+                    del day[machine][value]
+                    if not day[machine]:
+                        del day[machine]
+            self._drop_empty(date)
+
+    def _drop_empty(self, date):
+        if not self.days[date]:
+            del self.days[date]
+            del self.dates[bisect_left(self.dates, date)]
+
+    def boards(self, start=None, end=None):
+        """Per machine the ranking over the days from `start` to `end` (both inclusive, either may be None)."""
+        low = bisect_left(self.dates, normalize_date(start)) if start else 0
+        high = bisect_right(self.dates, normalize_date(end)) if end else len(self.dates)
+        merged = {}
+        for date in self.dates[low:high]:
+            for machine, best in self.days[date].items():
+                window = merged.setdefault(machine, {})
+                for player, (points, seq) in best.items():
+                    current = window.get(player)
+                    if current is None:
+                        window[player] = (points, seq)
+                    else:
+                        window[player] = (max(points, current[0]), min(seq, current[1]))
+        return {machine: sorted((-points, seq, player) for player, (points, seq) in window.items())
+                for machine, window in merged.items()}
+
+    def leaderboard(self, guest_status, start=None, end=None):
+        """
+        Highscores per machine and total standings over the scores from `start`
+        to `end`, ranked like the season leaderboard. Returns (highscores by machine, standings).
+        """
+        highscores = {}
+        totals = {}
+        for machine, ranking in self.boards(start, end).items():
+            highscores[machine] = rank_board(ranking, guest_status)
+            for entry in highscores[machine]:
+                total = totals.setdefault(entry['player'], [0, 0])
+                total[0] += entry['points']
+                total[1] += 1
+        return highscores, standings(totals)
@@ -0,0 +1,175 @@
+import datetime
+from bisect import bisect_left, bisect_right, insort
+
+
+def normalize_date(date):
+    """'YYYY-MM-DD' with zero padding, the form used as index key. Unparsable dates are kept as they are."""
+    try:
+        return datetime.datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return date
+
+
+class ScoreIndex:
+    """
+    Hash indexes over data['scores'] by machine, player and date, plus the
+    sorted list of all dates for range queries.
+
+    Every bucket holds the score dicts themselves in data order, so a lookup
+    returns the same list a filter over data['scores'] would.
+    """
+
+    def __init__(self, scores=None):
+        self.by_machine = {}      # pinball_abbreviation -> [score]
+        self.by_player = {}       # player_abbreviation -> [score]
+        self.by_date = {}         # normalized date -> [score]
+        self.dates = []           # sorted keys of by_date
+        self.machine_points = {}  # pinball_abbreviation -> sorted points of all its scores
+        if scores is not None:
+            self.rebuild(scores)
+
+    def rebuild(self, scores):
+        self.by_machine = {}
+        self.by_player = {}
+        self.by_date = {}
+        self.dates = []
+        self.machine_points = {}
+        for score in scores:
+            self.add(score)
+
+    def add(self, score):
+        self.by_machine.setdefault(score['pinball_abbreviation'], []).append(score)
+        self.by_player.setdefault(score['player_abbreviation'], []).append(score)
+        date = normalize_date(score['date'])
+        bucket = self.by_date.get(date)
+        if bucket is None:
+            bucket = self.by_date[date] = []
+            insort(self.dates, date)
+        bucket.append(score)
+        insort(self.machine_points.setdefault(score['pinball_abbreviation'], []), score['points'])
+
+    def remove(self, score):
+        if _remove(self.by_machine, score['pinball_abbreviation'], score):
+            del self.machine_points[score['pinball_abbreviation']]
+        else:
+            points = self.machine_points.get(score['pinball_abbreviation'])
+            index = bisect_left(points, score['points']) if points else None
+            if index is not None and index < len(points) and points[index] == score['points']:
+                del points[index]
+        _remove(self.by_player, score['player_abbreviation'], score)
+        date = normalize_date(score['date'])
+        if _remove(self.by_date, date, score):
+            del self.dates[bisect_left(self.dates, date)]
+
+    def remove_player(self, player_abbreviation):
+        """Drops all scores of a player, returns them."""
+        scores = list(self.by_player.get(player_abbreviation, ()))
+        for score in scores:
+            self.remove(score)
+        return scores
+
+    def remove_machine(self, pinball_abbreviation):
+        """Drops all scores of a machine, returns them."""
+        scores = list(self.by_machine.get(pinball_abbreviation, ()))
+        for score in scores:
+            self.remove(score)
+        return scores
+
+    def remove_many(self, scores):
+        """Drops a batch of scores, every affected bucket is filtered once."""
+        removed = {id(score) for score in scores}
+        machines = {score['pinball_abbreviation'] for score in scores}
+        for buckets, keys in ((self.by_machine, machines),
+                              (self.by_player, {score['player_abbreviation'] for score in scores}),
+                              (self.by_date, {normalize_date(score['date']) for score in scores})):
+            for key in keys:
+                bucket = [score for score in buckets.get(key, ()) if id(score) not in removed]
+                if bucket:
+                    buckets[key] = bucket
+                else:
+                    buckets.pop(key, None)
+        for machine in machines:
+            if machine in self.by_machine:
+                self.machine_points[machine] = sorted(score['points'] for score in self.by_machine[machine])
+            else:
+                self.machine_points.pop(machine, None)
+        self.dates = [date for date in self.dates if date in self.by_date]
+
+    def machine(self, pinball_abbreviation):
+        return self.by_machine.get(pinball_abbreviation, [])
+
+    def player(self, player_abbreviation):
+        return self.by_player.get(player_abbreviation, [])
+
+    def machine_counts(self):
+        """Number of scores per machine, machines without scores left out."""
+        return {machine: len(scores) for machine, scores in self.by_machine.items()}
+
+    def date(self, date):
+        return self.by_date.get(normalize_date(date), [])
+
+    def position(self, score):
+        """
+        1-based position of an indexed score among all scores of its machine, best
+        first, as a stable sort by points gives it (the first score of the player
+        with these points counts).
+        """
+        points = self.machine_points[score['pinball_abbreviation']]
+        low = bisect_left(points, score['points'])
+        high = bisect_right(points, score['points'])
+        higher = len(points) - high
+        if high - low == 1:
+            # `score` itself is the only one with these points
+            return higher + 1
+        # Equal points keep the data order
+        tied = (s for s in self.by_machine[score['pinball_abbreviation']] if s['points'] == score['points'])
+        return next((higher + index for index, s in enumerate(tied, start=1)
+                     if s['player_abbreviation'] == score['player_abbreviation']), None)
+
+    def newest_first(self, start=None, end=None, offset=0, limit=None):
+        """
+        One page of the scores from `start` to `end` (both inclusive, either may be
+        None), newest date first and in data order within a day. Whole days before
+        `offset` are skipped by their size. Returns (page, total).
+        """
+        low = bisect_left(self.dates, normalize_date(start)) if start else 0
+        high = bisect_right(self.dates, normalize_date(end)) if end else len(self.dates)
+        dates = self.dates[low:high]
+        total = sum(len(self.by_date[date]) for date in dates)
+
+        page = []
+        for date in reversed(dates):
+            if limit is not None and len(page) >= limit:
+                break
+            bucket = self.by_date[date]
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            end_index = offset + limit - len(page) if limit is not None else len(bucket)
+            page.extend(bucket[offset:end_index])
+            offset = 0
+        return page, total
+
+    def date_range(self, start=None, end=None):
+        """Scores from `start` to `end` (both inclusive, either may be None), oldest date first."""
+        low = bisect_left(self.dates, normalize_date(start)) if start else 0
+        high = bisect_right(self.dates, normalize_date(end)) if end else len(self.dates)
+        scores = []
+        for date in self.dates[low:high]:
+            scores.extend(self.by_date[date])
+        return scores
+
+
+def _remove(buckets, key, score):
+    """Removes `score` (by identity) from its bucket. Returns True if the bucket is gone afterwards."""
+    bucket = buckets.get(key)
+    if bucket is None:
+        return False
+    for index, candidate in enumerate(bucket):
+        if candidate is score:
+            del bucket[index]
+            break
+    if bucket:
+        return False
+    del buckets[key]
+    return True
@@ -0,0 +1,129 @@
+import gzip
+import json
+
+from flask import current_app, request
+
+from http_cache import GZIP_MIN_SIZE
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder does the same, only slower
+    orjson = None
+
+
+def encode(value):
+    """Compact JSON bytes with sorted keys, like jsonify produces them."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Integers beyond 64 bit and other things orjson refuses
+            pass
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8')
+
+
+class FieldError(ValueError):
+    """None of the ?fields= exist in the rows of the response."""
+
+
+def parse_fields(fields):
+    """?fields=a,b,c as a sorted tuple (the cache key; the keys are sent sorted anyway), None if not given."""
+    if not fields:
+        return None
+    return tuple(sorted({field.strip() for field in fields.split(',') if field.strip()})) or None
+
+
+def select_fields(value, fields):
+    """
+    Keeps only `fields` of the row objects: the objects in lists that don't hold
+    lists of objects themselves, like the players of /players or the entries of
+    every machine's highscores in /highscores. The objects around the rows keep
+    all their keys. Raises FieldError if there are rows but none has any of the fields.
+    """
+    found = set()
+    rows = 0
+
+    def select(value):
+        nonlocal rows
+        if isinstance(value, list):
+            selected = []
+            for item in value:
+                if _is_row(item):
+                    rows += 1
+                    found.update(field for field in fields if field in item)
+                    selected.append({field: item[field] for field in fields if field in item})
+                else:
+                    selected.append(select(item))
+            return selected
+        if isinstance(value, dict):
+            return {key: select(item) for key, item in value.items()}
+        return value
+
+    selected = select(value)
+    if rows and not found:
+        raise FieldError(f"Unknown fields: {', '.join(fields)}")
+    return selected
+
+
+def _is_row(value):
+    return isinstance(value, dict) and not any(
+        isinstance(item, list) and any(isinstance(element, dict) for element in item) for item in value.values())
+
+
+def compact(value):
+    """Lists of objects become {'fields': [...], 'rows': [[...], ...]}, so the keys are sent once per list."""
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            fields = list(dict.fromkeys(key for item in value for key in item))
+            return {'fields': fields, 'rows': [[compact(item.get(field)) for field in fields] for item in value]}
+        return [compact(item) for item in value]
+    if isinstance(value, dict):
+        return {key: compact(item) for key, item in value.items()}
+    return value
+
+
+class EncodedBody:
+    """A response body encoded once, gzip-compressed on first demand."""
+
+    __slots__ = ('body', '_gzipped')
+
+    def __init__(self, body):
+        self.body = body
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+def json_response(state, key, compute):
+    """
+    JSON response for a read view, encoded once per data version (cached in the
+    TournamentState views), view `key` and shape: ?fields=a,b keeps only these
+    keys of the row objects (see select_fields), ?compact=1 sends lists of
+    objects as {'fields', 'rows'}. Repeat requests only copy the cached bytes.
+    """
+    fields = parse_fields(request.args.get('fields'))
+    as_compact = request.args.get('compact') in ('1', 'true')
+
+    def render():
+        value = compute()
+        if fields is not None:
+            value = select_fields(value, fields)
+        if as_compact:
+            value = compact(value)
+        return EncodedBody(encode(value))
+
+    try:
+        encoded = state.view(('json', key, fields, as_compact), render)
+    except FieldError as e:
+        return current_app.response_class(encode({'error': str(e)}), status=400, mimetype='application/json')
+    response = current_app.response_class(mimetype='application/json')
+    if len(encoded.body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+        response.set_data(encoded.gzipped())
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    else:
+        response.set_data(encoded.body)
+    return response
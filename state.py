@@ -0,0 +1,315 @@
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from flask import g, has_app_context
+from werkzeug.local import LocalProxy
+
+from data_manager import snapshot_data, delete_many_filter, keep_score
+from leaderboard import LeaderboardIndex
+from player_stats import PlayerStatsIndex
+from rollups import DailyRollup
+from score_index import ScoreIndex
+from validation import ScoreStatistics
+
+# Views kept per state copy; request parameters are part of their keys, so the least recently used are dropped
+VIEW_CACHE_SIZE = 256
+
+
+class TournamentState:
+    """
+    The tournament data together with every index derived from it.
+
+    All changes go through apply(), which takes the same mutation records the
+    storage backends persist (see data_manager.apply_mutation) and keeps the
+    indexes in step with data.
+    """
+
+    def __init__(self, data):
+        self.readers = 0
+        self._views_lock = threading.Lock()
+        self.rebuild(data)
+
+    def rebuild(self, data):
+        self.data = data
+        self.leaderboard = LeaderboardIndex(data)
+        self.player_stats = PlayerStatsIndex(data)
+        self.score_index = ScoreIndex(data['scores'])
+        self.score_statistics = ScoreStatistics(data['scores'])
+        self.daily = DailyRollup(data['scores'])
+        self.views = OrderedDict()
+
+    def view(self, key, compute):
+        """
+        A view derived from this state (a response body, ...), computed once until
+        the next change. Only the VIEW_CACHE_SIZE most recently used are kept.
+        """
+        with self._views_lock:
+            value = self.views.get(key)
+            if value is not None:
+                self.views.move_to_end(key)
+                return value
+        # Computed outside the lock, views may be built from other views
+        value = compute()
+        with self._views_lock:
+            value = self.views.setdefault(key, value)
+            self.views.move_to_end(key)
+            while len(self.views) > VIEW_CACHE_SIZE:
+                self.views.popitem(last=False)
+        return value
+
+    def apply(self, mutation):
+        """Applies a mutation record. Returns what it removed, see the _delete_* methods."""
+        self.views = OrderedDict()
+        op = mutation['op']
+        if op == 'add_score':
+            return self._add_score(mutation['score'])
+        if op == 'add_scores':
+            for score in mutation['scores']:
+                self._add_score(score)
+            return None
+        if op == 'delete_score':
+            return self._delete_score(mutation['score'])
+        if op == 'add_player':
+            return self._add_player(mutation['player'])
+        if op == 'delete_player':
+            return self._delete_player(mutation['abbreviation'])
+        if op == 'delete_many':
+            return self._delete_many(mutation)
+        if op == 'add_pinball':
+            return self._add_pinball(mutation['pinball'])
+        if op == 'delete_pinball':
+            return self._delete_pinball(mutation['abbreviation'])
+        raise ValueError(f"Unknown mutation '{op}'")
+
+    def find_score(self, pinball_abbreviation, player_abbreviation, points):
+        """The first score (in data order) of a player on a machine with exactly `points`."""
+        return next((score for score in self.score_index.machine(pinball_abbreviation)
+                     if score['player_abbreviation'] == player_abbreviation
+                     and score['points'] == points), None)
+
+    def _add_score(self, score):
+        # The leaderboard checks the points, so a refused score changes nothing
+        self.leaderboard.add_score(score)
+        self.data['scores'].append(score)
+        self.player_stats.add_score(score)
+        self.score_index.add(score)
+        self.score_statistics.add_score(score)
+        self.daily.add(score)
+
+    def _delete_score(self, score):
+        score_to_delete = self.find_score(score['pinball_abbreviation'], score['player_abbreviation'], score['points'])
+        if score_to_delete is None:
+            return None
+        self.data['scores'].remove(score_to_delete)
+        self.player_stats.remove_score(score_to_delete)
+        self.score_index.remove(score_to_delete)
+        self.score_statistics.remove_score(score_to_delete)
+        self.daily.remove(score_to_delete, self.score_index.date(score_to_delete['date']))
+        self.leaderboard.rebuild_machine(score_to_delete['pinball_abbreviation'],
+                                         self.score_index.machine(score_to_delete['pinball_abbreviation']))
+        return score_to_delete
+
+    def _add_player(self, player):
+        self.data['players'].append(player)
+        self.leaderboard.update_players(self.data['players'])
+        self.player_stats.update_players(self.data['players'])
+
+    def _delete_player(self, player_abbreviation):
+        """Returns (deleted player or None, deleted scores)."""
+        deleted_scores = self.score_index.remove_player(player_abbreviation)
+        if deleted_scores:
+            self.data['scores'] = [score for score in self.data['scores']
+                                   if score['player_abbreviation'] != player_abbreviation]
+        self.leaderboard.remove_player(player_abbreviation)
+        self.player_stats.remove_player(player_abbreviation)
+        for score in deleted_scores:
+            self.score_statistics.remove_score(score)
+        self.daily.remove_scores(deleted_scores, 'player', player_abbreviation)
+
+        player_to_delete = next((player for player in self.data['players']
+                                 if player['abbreviation'] == player_abbreviation), None)
+        if player_to_delete:
+            self.data['players'].remove(player_to_delete)
+            self.leaderboard.update_players(self.data['players'])
+            self.player_stats.update_players(self.data['players'])
+        return player_to_delete, deleted_scores
+
+    def _delete_many(self, mutation):
+        """
+        Batch delete in one pass over the scores (see data_manager.delete_many_filter),
+        every index is updated once. Returns {'players', 'machines', 'scores'} with
+        what was removed, plus the 'missing_scores' that matched nothing.
+        """
+        players, machines, pending = delete_many_filter(mutation)
+        kept = []
+        deleted_scores = []
+        for score in self.data['scores']:
+            (kept if keep_score(score, players, machines, pending) else deleted_scores).append(score)
+        self.data['scores'] = kept
+
+        deleted_players = [player for player in self.data['players'] if player['abbreviation'] in players]
+        deleted_machines = [machine for machine in self.data['pinball_machines'] if machine['abbreviation'] in machines]
+        if deleted_players:
+            self.data['players'] = [player for player in self.data['players'] if player['abbreviation'] not in players]
+        if deleted_machines:
+            self.data['pinball_machines'] = [machine for machine in self.data['pinball_machines']
+                                             if machine['abbreviation'] not in machines]
+
+        self.score_index.remove_many(deleted_scores)
+        for machine in machines:
+            self.score_statistics.remove_machine(machine)
+        for player in players:
+            self.player_stats.remove_player(player)
+        for score in deleted_scores:
+            if score['pinball_abbreviation'] not in machines:
+                self.score_statistics.remove_score(score)
+            if score['player_abbreviation'] not in players:
+                self.player_stats.remove_score(score)
+        if deleted_players:
+            self.player_stats.update_players(self.data['players'])
+        if deleted_machines:
+            self.player_stats.update_machines(self.data['pinball_machines'])
+        self.daily.remove_many(deleted_scores, self.score_index.date)
+
+        changed = {score['pinball_abbreviation'] for score in deleted_scores} - machines
+        self.leaderboard.remove_many(machines, {machine: self.score_index.machine(machine) for machine in changed},
+                                     self.data['players'] if deleted_players else None)
+
+        missing = []
+        for score in mutation.get('scores', ()):
+            key = (score['pinball_abbreviation'], score['player_abbreviation'], score['points'])
+            if pending.get(key):
+                pending[key] -= 1
+                missing.append(score)
+        return {'players': deleted_players, 'machines': deleted_machines, 'scores': deleted_scores,
+                'missing_scores': missing}
+
+    def _add_pinball(self, pinball):
+        self.data['pinball_machines'].append(pinball)
+        self.player_stats.update_machines(self.data['pinball_machines'])
+
+    def _delete_pinball(self, pinball_abbreviation):
+        """Returns (deleted machine or None, deleted scores)."""
+        deleted_scores = self.score_index.remove_machine(pinball_abbreviation)
+        if deleted_scores:
+            self.data['scores'] = [score for score in self.data['scores']
+                                   if score['pinball_abbreviation'] != pinball_abbreviation]
+        self.leaderboard.remove_machine(pinball_abbreviation)
+        for score in deleted_scores:
+            self.player_stats.remove_score(score)
+        self.score_statistics.remove_machine(pinball_abbreviation)
+        self.daily.remove_scores(deleted_scores, 'machine', pinball_abbreviation)
+
+        pinball_to_delete = next((machine for machine in self.data['pinball_machines']
+                                  if machine['abbreviation'] == pinball_abbreviation), None)
+        if pinball_to_delete:
+            self.data['pinball_machines'].remove(pinball_to_delete)
+            self.player_stats.update_machines(self.data['pinball_machines'])
+        return pinball_to_delete, deleted_scores
+
+
+class StateManager:
+    """
+    Two copies of the TournamentState, one published for readers and one for the writer.
+
+    Readers pick up the published copy and never wait: nothing modifies it while
+    it is published. Writers are serialized; a mutation is applied to the other
+    copy, which is then published in one step. Once the last reader has left the
+    previous copy, the same mutation is applied to it, so both copies are equal
+    again before the next write. The score/player/machine dicts are shared by the
+    copies and never modified.
+    """
+
+    def __init__(self, data, exclusive=None):
+        self.published = TournamentState(data)
+        self.back = TournamentState(snapshot_data(data))
+        # Entered by every writer after the local lock, e.g. to hold a lock shared with
+        # other processes and catch up with their changes first
+        self.exclusive = exclusive or nullcontext
+        self._write_lock = threading.RLock()
+        self._readers_lock = threading.Condition()
+
+    @contextmanager
+    def read(self):
+        with self._readers_lock:
+            state = self.published
+            state.readers += 1
+        try:
+            yield state
+        finally:
+            with self._readers_lock:
+                state.readers -= 1
+                if not state.readers:
+                    self._readers_lock.notify_all()
+
+    @contextmanager
+    def write(self, exclusive=True):
+        """Serializes writers. Yields the copy a writer may inspect; change it through apply() only."""
+        with self._write_lock, self.exclusive() if exclusive else nullcontext():
+            yield self.back
+
+    def apply(self, mutation):
+        with self._write_lock:
+            try:
+                result = self.back.apply(mutation)
+            except Exception:
+                # Applied halfway at most: start over from the published copy, which is untouched
+                self.back.rebuild(snapshot_data(self.published.data))
+                raise
+            self._swap().apply(mutation)
+            return result
+
+    def reload(self, data):
+        """Replaces the whole state, e.g. with newer data from the storage backend."""
+        with self._write_lock:
+            self.back.rebuild(data)
+            self._swap().rebuild(snapshot_data(data))
+
+    def _swap(self):
+        # Publish the updated copy, then wait until nobody reads the old one anymore
+        with self._readers_lock:
+            previous, self.published = self.published, self.back
+            while previous.readers:
+                self._readers_lock.wait()
+        self.back = previous
+        return previous
+
+    def current(self):
+        """The copy the running request works with, the published one outside of reader/writer."""
+        if has_app_context():
+            state = g.get('state')
+            if state is not None:
+                return state
+        return self.published
+
+    def proxy(self, name):
+        """Stand-in for an attribute of the current copy, so views can keep using plain module names."""
+        return LocalProxy(lambda: getattr(self.current(), name))
+
+    def reader(self, view):
+        """Decorator for read-only views: they run against the published copy."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with self.read() as state:
+                previous = g.get('state')
+                g.state = state
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    g.state = previous
+        return wrapper
+
+    def writer(self, view):
+        """Decorator for mutating views: they run one at a time and see the latest state."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with self.write() as state:
+                previous = g.get('state')
+                g.state = state
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    g.state = previous
+        return wrapper
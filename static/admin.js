@@ -0,0 +1,147 @@
+// Seitenweises Laden der Scores über /admin/scores, neueste zuerst
+const ADMIN_PAGE_SIZE = 50;
+
+let adminOffset = 0;
+let adminTotal = 0;
+let adminQuery = '';
+
+document.addEventListener('DOMContentLoaded', function() {
+    loadFilterOptions();
+
+    document.getElementById('scoreFilterForm').addEventListener('submit', function(event) {
+        event.preventDefault();
+        resetAdminScores();
+    });
+    document.getElementById('loadMoreScores').addEventListener('click', loadAdminScores);
+
+    // Die nächste Seite wird geladen, sobald der Button ins Bild scrollt
+    if (window.IntersectionObserver) {
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadAdminScores();
+            }
+        });
+        observer.observe(document.getElementById('loadMoreScores'));
+    }
+
+    resetAdminScores();
+});
+
+function loadFilterOptions() {
+    fillSelect('filterPlayer', '/players', player => [player.abbreviation, `${player.name} - ${player.abbreviation}`]);
+    fillSelect('filterPinball', '/pinball', machine => [machine.abbreviation, `${machine.long_name} - ${machine.abbreviation}`]);
+}
+
+function fillSelect(id, url, option) {
+    fetch(url)
+        .then(response => response.json())
+        .then(entries => {
+            const select = document.getElementById(id);
+            const selected = select.value;
+            select.length = 1;
+            entries.forEach(entry => {
+                const [value, text] = option(entry);
+                select.add(new Option(text, value, false, value === selected));
+            });
+        })
+        .catch(error => console.error('Error:', error));
+}
+
+function resetAdminScores() {
+    const params = new URLSearchParams();
+    const filters = { player: 'filterPlayer', machine: 'filterPinball', from: 'filterFrom', to: 'filterTo' };
+    Object.entries(filters).forEach(([name, id]) => {
+        const value = document.getElementById(id).value;
+        if (value) {
+            params.set(name, value);
+        }
+    });
+
+    adminQuery = params.toString();
+    adminOffset = 0;
+    adminTotal = 0;
+    document.getElementById('adminScores').innerHTML = '';
+    loadAdminScores();
+}
+
+let adminLoading = null;
+
+function loadAdminScores() {
+    if (adminLoading || (adminOffset > 0 && adminOffset >= adminTotal)) {
+        return;
+    }
+
+    const query = adminQuery;
+    const separator = query ? '&' : '';
+    adminLoading = fetch(`/admin/scores?${query}${separator}offset=${adminOffset}&limit=${ADMIN_PAGE_SIZE}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            adminTotal = parseInt(response.headers.get('X-Total-Count'), 10) || 0;
+            return response.json();
+        })
+        .then(scores => {
+            // Filter wurde inzwischen geändert
+            if (query !== adminQuery) {
+                return;
+            }
+            const tbody = document.getElementById('adminScores');
+            scores.forEach(score => tbody.appendChild(adminScoreRow(score)));
+            adminOffset += scores.length;
+            updateAdminStatus();
+        })
+        .catch(error => console.error('Error:', error))
+        .finally(() => {
+            adminLoading = null;
+            if (query !== adminQuery) {
+                loadAdminScores();
+            }
+        });
+}
+
+function adminScoreRow(score) {
+    const row = document.createElement('tr');
+    [
+        `${score.player} - ${score.player_abbreviation}`,
+        `${score.pinball} - ${score.pinball_abbreviation}`,
+        score.points,
+        score.date
+    ].forEach(text => {
+        const cell = document.createElement('td');
+        cell.textContent = text;
+        row.appendChild(cell);
+    });
+
+    const action = document.createElement('td');
+    const button = document.createElement('button');
+    button.className = 'delete-button';
+    button.textContent = 'Delete';
+    button.addEventListener('click', () => deleteScore(row, score));
+    action.appendChild(button);
+    row.appendChild(action);
+    return row;
+}
+
+function deleteScore(row, score) {
+    fetch(`/delete_score/${score.pinball_abbreviation}/${score.player_abbreviation}/${score.points}`, {
+        method: 'DELETE',
+    })
+    .then(response => response.json())
+    .then(data => {
+        console.log(data);
+        // Nur die Zeile entfernen, die übrigen bleiben stehen
+        if (data.message === "Score deleted") {
+            row.remove();
+            adminOffset -= 1;
+            adminTotal -= 1;
+            updateAdminStatus();
+        }
+    })
+    .catch(error => console.error('Error:', error));
+}
+
+function updateAdminStatus() {
+    document.getElementById('adminScoresStatus').textContent = `${adminOffset} of ${adminTotal} scores`;
+    document.getElementById('loadMoreScores').style.display = adminOffset < adminTotal ? '' : 'none';
+}
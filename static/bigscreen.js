@@ -0,0 +1,31 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Nur die Tabellen neu laden statt der ganzen Seite; der Server antwortet mit 304, solange sich nichts ändert
+    setInterval(refreshTables, 30000);
+    subscribeToEvents();
+});
+
+function refreshTables() {
+    fetch('/bigscreen/tables')
+        .then(response => response.ok ? response.text() : null)
+        .then(html => {
+            const container = document.getElementById('bigscreen-tables');
+            if (html !== null && container.innerHTML !== html) {
+                container.innerHTML = html;
+            }
+        })
+        .catch(error => console.error('Error refreshing bigscreen:', error));
+}
+
+function subscribeToEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    // Mehrere Änderungen kurz hintereinander lösen nur eine Aktualisierung aus
+    let refreshTimer = null;
+    const source = new EventSource('/events');
+    source.onmessage = function() {
+        clearTimeout(refreshTimer);
+        refreshTimer = setTimeout(refreshTables, 500);
+    };
+}
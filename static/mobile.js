@@ -33,6 +33,37 @@ function setupInputListeners() {
     document.getElementById('player-select').addEventListener('change', validateInputs);
     document.getElementById('pinball-select').addEventListener('change', validateInputs);
     document.getElementById('score-input').addEventListener('input', validateInputs);
+    document.getElementById('score-input').addEventListener('input', schedulePreviewRank);
+    document.getElementById('player-select').addEventListener('change', schedulePreviewRank);
+    document.getElementById('pinball-select').addEventListener('change', schedulePreviewRank);
+}
+
+let previewTimer = null;
+
+function schedulePreviewRank() {
+    // Erst abfragen, wenn kurz nicht mehr getippt wurde
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(loadPreviewRank, 300);
+}
+
+function loadPreviewRank() {
+    const player = document.getElementById('player-select').value;
+    const pinball = document.getElementById('pinball-select').value;
+    const points = parseInt(document.getElementById('score-input').value.replaceAll(",", ""));
+    const preview = document.getElementById('score-preview');
+
+    if (!player || !pinball || !points) {
+        preview.innerHTML = '';
+        return;
+    }
+
+    fetch(`/preview-rank/${pinball}/${player}/${points}`)
+        .then(response => response.json())
+        .then(data => {
+            preview.innerHTML = data.personalBest
+                ? `Rank ${data.rank} &middot; ${data.points} points`
+                : 'No new personal best';
+        });
 }
 
 function validateInputs() {
@@ -52,7 +83,7 @@ function validateInputs() {
 
 
 function loadPlayers() {
-    fetch('/players')
+    fetch('/players?fields=abbreviation,name')
         .then(response => response.json())
         .then(players => {
             const playerSelect = document.getElementById('player-select');
@@ -78,7 +109,7 @@ function loadPlayers() {
 
 
 function loadPinballMachines() {
-    fetch('/pinball')
+    fetch('/pinball?fields=abbreviation,long_name,room')
         .then(response => response.json())
         .then(pinballMachines => {
             const pinballSelect = document.getElementById('pinball-select');
@@ -121,29 +152,42 @@ function submitScore() {
     const today = new Date();
     const formattedDate = today.toISOString().split('T')[0];
 
-    fetch('/score', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-            player_abbreviation: player,
-            pinball_abbreviation: pinball,
-            points: parseInt(score.replaceAll(",","")),
-            date: formattedDate
-        })
+    const scoreData = {
+        player_abbreviation: player,
+        pinball_abbreviation: pinball,
+        points: parseInt(score.replaceAll(",","")),
+        date: formattedDate
+    };
+
+    postScore(scoreData, false)
+    .then(response => {
+        // Der Server hält den Score für einen Tippfehler, nur nach Bestätigung trotzdem speichern
+        if (response.status === 422 && confirm('This score looks unusual for this machine. Submit anyway?')) {
+            return postScore(scoreData, true);
+        }
+        return response;
     })
     .then(response => {
         if (response.ok) {
             alert('Score submitted successful!');
             scoreInput.value = ''; // Clear the score input field
             validateInputs(); // Re-validate inputs to disable the submit button
-        } else {
+        } else if (response.status !== 422) {
             alert('Error submitting score.');
         }
     });
 }
 
+function postScore(scoreData, force) {
+    return fetch(force ? '/score?force=1' : '/score', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(scoreData)
+    });
+}
+
 
 function formatScoreInput(inputElement) {
     // Ersetze alle Zeichen außer Zahlen und entferne führende Nullen
@@ -6,7 +6,7 @@ document.addEventListener('DOMContentLoaded', function() {
 let allPinballMachines = [];
 
 function loadPlayers() {
-    fetch('/players')
+    fetch('/players?fields=abbreviation,name')
         .then(response => response.json())
         .then(players => {
             const playerSelect = document.getElementById('player-select');
@@ -21,7 +21,7 @@ function loadPlayers() {
 }
 
 function loadPinballMachinesData() {
-    fetch('/pinball')
+    fetch('/pinball?fields=abbreviation,long_name')
         .then(response => response.json())
         .then(pinballMachines => {
             allPinballMachines = pinballMachines;
@@ -1,7 +1,8 @@
 document.addEventListener('DOMContentLoaded', function() {
-    loadPlayers();
-    loadData();
+    // Erst die Spielernamen laden, damit die Tabellen nicht nur Kürzel anzeigen
+    loadPlayers().then(loadData);
     setInterval(loadData, 60000); // Aktualisiert die Daten jede Minute
+    subscribeToEvents(); // Und sofort, sobald der Server eine Änderung meldet
 
     const searchInput = document.getElementById('pinball-search');
     if (searchInput) {
@@ -13,7 +14,7 @@ document.addEventListener('DOMContentLoaded', function() {
 let playerNamesMap = {};
 
 function loadPlayers() {
-    fetch('/players')
+    return fetch('/players?fields=abbreviation,name')
         .then(response => response.json())
         .then(players => {
             playerNamesMap = players.reduce((map, player) => {
@@ -66,33 +67,78 @@ function displayTotalHighscores(data) {
 }
 
 
+let allHighscores = [];
+
 function fetchPinballHighscores() {
-    fetch('/pinball')
+    // Alle Tabellen kommen in einer Antwort, die Tabellen zeigen ohnehin nur die Top 15
+    fetch('/highscores?top=15')
         .then(response => response.json())
-        .then(pinballMachines => {
+        .then(highscores => {
             // Sortieren der Flipperautomaten alphabetisch nach ihrem langen Namen
-            pinballMachines.sort((a, b) => a.long_name.localeCompare(b.long_name));
-
-            // Highscores für jeden Flipperautomaten abrufen
-            const highscorePromises = pinballMachines.map(machine =>
-                fetch(`/highscore/pinball/${machine.abbreviation}`)
-                    .then(response => response.json())
-                    .then(highscores => ({ machine, highscores }))
-            );
-
-            return Promise.all(highscorePromises);
-        })
-        .then(allHighscores => {
-            const container = document.getElementById('pinball-highscore-content');
-            container.innerHTML = ''; // Leeren des Containers
-
-            allHighscores.forEach(({ machine, highscores }) => {
-                displayPinballHighscores(machine, highscores);
+            highscores.sort((a, b) => a.machine.long_name.localeCompare(b.machine.long_name));
+            allHighscores = highscores;
+            const searchInput = document.getElementById('pinball-search');
+            displayFilteredPinballHighscores(searchInput ? searchInput.value : '');
+        });
+}
+
+
+function refreshMachineHighscores(machines) {
+    fetch(`/highscores?top=15&machines=${machines.map(encodeURIComponent).join(',')}`)
+        .then(response => response.json())
+        .then(highscores => {
+            highscores.forEach(updated => {
+                const index = allHighscores.findIndex(item => item.machine.abbreviation === updated.machine.abbreviation);
+                if (index >= 0) {
+                    allHighscores[index] = updated;
+                } else {
+                    allHighscores.push(updated);
+                }
             });
+            allHighscores.sort((a, b) => a.machine.long_name.localeCompare(b.machine.long_name));
+            const searchInput = document.getElementById('pinball-search');
+            displayFilteredPinballHighscores(searchInput ? searchInput.value : '');
         });
 }
 
 
+function subscribeToEvents() {
+    if (!window.EventSource || !document.getElementById('total-highscore-list')) {
+        return;
+    }
+
+    const changedMachines = new Set();
+    let fullReload = false;
+    let refreshTimer = null;
+
+    // Der Browser verbindet sich selbst neu und schickt dabei die letzte Event-ID mit
+    const source = new EventSource('/events');
+    source.onmessage = function(event) {
+        const change = JSON.parse(event.data);
+        if (change.op === 'add_score' || change.op === 'delete_score') {
+            changedMachines.add(change.score.pinball_abbreviation);
+        } else if (change.op === 'add_scores') {
+            change.machines.forEach(machine => changedMachines.add(machine));
+        } else {
+            fullReload = true;
+        }
+
+        // Mehrere Änderungen kurz hintereinander werden zusammen geladen
+        clearTimeout(refreshTimer);
+        refreshTimer = setTimeout(() => {
+            if (fullReload) {
+                loadPlayers().then(loadData);
+            } else {
+                fetchTotalHighscores();
+                refreshMachineHighscores([...changedMachines]);
+            }
+            fullReload = false;
+            changedMachines.clear();
+        }, 500);
+    };
+}
+
+
 function displayPinballHighscores(machine, highscores) {
     const container = document.getElementById('pinball-highscore-content');
     const section = document.createElement('section');
@@ -131,23 +177,10 @@ function displayFilteredPinballHighscores(searchText) {
     const container = document.getElementById('pinball-highscore-content');
     container.innerHTML = ''; // Leert den Container vor dem Hinzufügen gefilterter Ergebnisse
 
-    fetch('/pinball')
-        .then(response => response.json())
-        .then(pinballMachines => {
-            // Filtern basierend auf dem Suchtext
-            const filteredMachines = pinballMachines.filter(machine =>
-                machine.long_name.toLowerCase().includes(searchText.toLowerCase())
-            );
-
-            // Anzeigen der gefilterten Highscores
-            filteredMachines.forEach(machine => {
-                fetch(`/highscore/pinball/${machine.abbreviation}`)
-                    .then(response => response.json())
-                    .then(highscores => {
-                        displayPinballHighscores(machine, highscores);
-                    });
-            });
-        });
+    // Filtern der bereits geladenen Highscores basierend auf dem Suchtext
+    allHighscores
+        .filter(({ machine }) => machine.long_name.toLowerCase().includes(searchText.toLowerCase()))
+        .forEach(({ machine, highscores }) => displayPinballHighscores(machine, highscores));
 }
 
 // Intervall in Millisekunden (z.B. 60000 für eine Minute)
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The modules live in the repository root; data_manager picks its backend on import,
+# so keep the tests away from the Gist and the data/ directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['STORAGE_BACKEND'] = 'journal'
+os.environ['JOURNAL_DIR'] = tempfile.mkdtemp(prefix='aixplay-tests-')
+os.environ.pop('GIST_ID', None)
+os.environ.pop('METRICS_DIR', None)
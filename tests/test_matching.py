@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from matching import suggest_matches
+
+
+def random_evening(rng, players, machines):
+    machine_bits = {f'M{bit}': bit for bit in range(machines)}
+    unplayed = {f'P{index}': rng.getrandbits(machines) for index in range(players)}
+    return unplayed, machine_bits
+
+
+def check_schedule(matches, unplayed, machines, max_suggestions):
+    load = {}
+    for machine, player1, player2 in matches:
+        assert player1 != player2
+        for player in (player1, player2):
+            assert unplayed[player] >> machines[machine] & 1, (machine, player)
+            load[player] = load.get(player, 0) + 1
+    assert all(count <= max_suggestions for count in load.values())
+
+    used = [machine for machine, _, _ in matches]
+    assert used == [machine for machine in machines if machine in used]
+    # Maximal: no unused machine has two candidates left who could still take it
+    for machine, bit in machines.items():
+        if machine not in used:
+            free = [player for player, mask in unplayed.items()
+                    if mask >> bit & 1 and load.get(player, 0) < max_suggestions]
+            assert len(free) < 2, machine
+
+
+@pytest.mark.parametrize('max_suggestions', [1, 2, 3])
+def test_schedule_is_valid_and_maximal(max_suggestions):
+    rng = random.Random(max_suggestions)
+    for _ in range(300):
+        unplayed, machines = random_evening(rng, rng.randint(0, 9), rng.randint(0, 7))
+        matches = suggest_matches(unplayed, machines, max_suggestions)
+        check_schedule(matches, unplayed, machines, max_suggestions)
+
+
+def test_players_are_moved_to_make_room():
+    # M0 comes first and takes P0 and P2, M1 only gets its second player if P3 takes over on M0
+    unplayed = {'P0': 0b11, 'P1': 0b10, 'P2': 0b11, 'P3': 0b01}
+    machines = {'M0': 0, 'M1': 1}
+    matches = suggest_matches(unplayed, machines, max_suggestions=1)
+    assert len(matches) == 2
+    check_schedule(matches, unplayed, machines, 1)
+
+
+def test_no_machine_with_a_single_player():
+    unplayed = {'P0': 0b11, 'P1': 0b01}
+    assert suggest_matches(unplayed, {'M0': 0, 'M1': 1}) == [('M0', 'P0', 'P1')]
+    assert suggest_matches({'P0': 0b1}, {'M0': 0}) == []
+
+
+def test_large_evening():
+    rng = random.Random(0)
+    unplayed, machines = random_evening(rng, 120, 60)
+    matches = suggest_matches(unplayed, machines)
+    check_schedule(matches, unplayed, machines, 2)
+    # Enough candidates everywhere, every player ends up with two machines
+    assert len(matches) == 60
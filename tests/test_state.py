@@ -0,0 +1,171 @@
+import random
+import threading
+
+import pytest
+
+from benchmark import generate_data
+from data_manager import apply_mutation, snapshot_data
+from state import StateManager, TournamentState
+
+
+def random_mutation(data, rng):
+    """A mutation record like the api routes write, against the current `data`."""
+    players = [player['abbreviation'] for player in data['players']]
+    machines = [machine['abbreviation'] for machine in data['pinball_machines']]
+    scores = data['scores']
+
+    def new_score():
+        return {'player_abbreviation': rng.choice(players), 'pinball_abbreviation': rng.choice(machines),
+                'points': rng.randrange(1, 50) * 1000, 'date': f'2024-05-{rng.randrange(1, 10):02d}'}
+
+    op = rng.choice(['add_score'] * 6 + ['delete_score'] * 3 + ['add_scores', 'add_player', 'delete_player',
+                                                               'add_pinball', 'delete_pinball', 'delete_many'])
+    if op in ('delete_player', 'delete_pinball', 'delete_many') and (len(players) < 4 or len(machines) < 4):
+        op = 'add_player' if len(players) < 4 else 'add_pinball'
+    if op == 'add_score' or (op == 'delete_score' and not scores):
+        return {'op': 'add_score', 'score': new_score()}
+    if op == 'delete_score':
+        # Sometimes a score that doesn't exist
+        return {'op': 'delete_score', 'score': rng.choice(scores) if rng.random() < 0.8 else new_score()}
+    if op == 'add_scores':
+        return {'op': 'add_scores', 'scores': [new_score() for _ in range(rng.randrange(1, 5))]}
+    if op == 'add_player':
+        index = rng.randrange(10 ** 6)
+        return {'op': 'add_player', 'player': {'name': f'New {index}', 'abbreviation': f'N{index}',
+                                               'guest': rng.random() < 0.3}}
+    if op == 'delete_player':
+        return {'op': 'delete_player', 'abbreviation': rng.choice(players)}
+    if op == 'add_pinball':
+        index = rng.randrange(10 ** 6)
+        return {'op': 'add_pinball', 'pinball': {'long_name': f'New {index}', 'abbreviation': f'X{index}', 'room': '1'}}
+    if op == 'delete_pinball':
+        return {'op': 'delete_pinball', 'abbreviation': rng.choice(machines)}
+    listed = rng.sample(scores, min(len(scores), 3)) + [new_score()]
+    return {'op': 'delete_many', 'players': rng.sample(players, 1), 'machines': rng.sample(machines, 1),
+            'scores': listed}
+
+
+def observe(state):
+    """Everything the routes read from the indexes of a TournamentState."""
+    data = state.data
+    players = sorted({player['abbreviation'] for player in data['players']}
+                     | {score['player_abbreviation'] for score in data['scores']})
+    machines = sorted({machine['abbreviation'] for machine in data['pinball_machines']}
+                      | {score['pinball_abbreviation'] for score in data['scores']})
+    dates = sorted({score['date'] for score in data['scores']})
+    leaderboard = state.leaderboard
+    return {
+        'scores': data['scores'],
+        'highscores': {machine: leaderboard.highscores(machine) for machine in sorted(leaderboard.machines())},
+        'standings': leaderboard.total_standings(),
+        'overview': {(machine, player): leaderboard.overview(machine, player)
+                     for machine in machines for player in players},
+        'preview': {(machine, player): leaderboard.preview(machine, player, 20000)
+                    for machine in machines for player in players},
+        'position': {(machine, player): leaderboard.position(machine, player)
+                     for machine in machines for player in players},
+        'player_stats': {player: (state.player_stats.get(player).machines, state.player_stats.get(player).dates,
+                                  sorted(state.player_stats.machines_in(state.player_stats.unplayed_mask(player))))
+                         for player in players},
+        'active_players': {date: sorted(state.player_stats.active_players(date)) for date in dates},
+        'by_machine': {machine: state.score_index.machine(machine) for machine in machines},
+        'by_player': {player: state.score_index.player(player) for player in players},
+        'score_positions': [state.score_index.position(score) for score in data['scores']],
+        'newest_first': state.score_index.newest_first(offset=3, limit=20),
+        'date_range': state.score_index.date_range('2024-05-03', '2024-05-06'),
+        'machine_counts': state.score_index.machine_counts(),
+        'statistics': {machine: state.score_statistics.check(machine, 20000) for machine in machines},
+        'daily': [state.daily.leaderboard(leaderboard.guest_status, start, end)
+                  for start, end in ((None, None), ('2024-05-02', '2024-05-04'), ('2024-05-07', None))],
+    }
+
+
+def assert_same_views(state, rebuilt):
+    expected = observe(rebuilt)
+    actual = observe(state)
+    for key, value in expected.items():
+        if key == 'statistics':
+            # Running mean and variance, removals leave rounding differences
+            for machine, verdict in value.items():
+                assert actual[key][machine] == pytest.approx(verdict, abs=0.02), machine
+        else:
+            assert actual[key] == value, key
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_indexes_match_rebuild(seed):
+    rng = random.Random(seed)
+    data = generate_data(players=12, machines=6, scores=150, days=9, seed=seed)
+    state = TournamentState(snapshot_data(data))
+    for step in range(60):
+        mutation = random_mutation(state.data, rng)
+        state.apply(mutation)
+        apply_mutation(data, mutation)
+        if step % 10 == 9:
+            assert_same_views(state, TournamentState(snapshot_data(data)))
+    assert state.data == data
+
+
+def test_delete_many_reports_missing_scores():
+    data = generate_data(players=5, machines=3, scores=40, seed=1)
+    state = TournamentState(snapshot_data(data))
+    score = next(score for score in data['scores'] if score['player_abbreviation'] != 'P000')
+    absent = dict(score, points=score['points'] + 1)
+    owned = next(score for score in data['scores'] if score['player_abbreviation'] == 'P000')
+
+    result = state.apply({'op': 'delete_many', 'players': ['P000'], 'scores': [score, absent, owned]})
+    assert result['missing_scores'] == [absent]
+    assert score in result['scores'] and owned in result['scores']
+
+
+def test_both_copies_equal_after_writes():
+    rng = random.Random(7)
+    data = generate_data(players=10, machines=5, scores=100, days=9)
+    manager = StateManager(data)
+    for _ in range(40):
+        with manager.read() as published:
+            mutation = random_mutation(published.data, rng)
+        manager.apply(mutation)
+        assert manager.back.data == manager.published.data
+        assert manager.back.data is not manager.published.data
+        assert observe(manager.back) == observe(manager.published)
+
+
+def test_failed_write_leaves_copies_equal():
+    data = generate_data(players=10, machines=5, scores=100)
+    manager = StateManager(data)
+    bad = {'player_abbreviation': 'P001', 'pinball_abbreviation': 'M01', 'points': 'abc', 'date': '2024-05-01'}
+    with pytest.raises((TypeError, ValueError)):
+        manager.apply({'op': 'add_score', 'score': bad})
+    assert manager.back.data == manager.published.data == data
+    assert observe(manager.back) == observe(manager.published)
+
+    manager.apply({'op': 'add_score', 'score': dict(bad, points=1000)})
+    assert manager.back.data == manager.published.data
+    assert manager.published.data['scores'][-1]['points'] == 1000
+    assert observe(manager.back) == observe(manager.published)
+
+
+def test_reload_replaces_both_copies():
+    manager = StateManager(generate_data(players=10, machines=5, scores=100))
+    data = generate_data(players=4, machines=2, scores=20, seed=3)
+    manager.reload(data)
+    assert manager.published.data == data
+    assert manager.back.data == data
+    assert manager.back.data is not manager.published.data
+
+
+def test_readers_keep_their_copy():
+    manager = StateManager(generate_data(players=10, machines=5, scores=100))
+    with manager.read() as state:
+        before = list(state.data['scores'])
+        score = dict(before[0], points=before[0]['points'] + 1)
+        # Apply from another thread: the swap has to wait for this reader to leave
+        writer = threading.Thread(target=manager.apply, args=({'op': 'add_score', 'score': score},))
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        assert state.data['scores'] == before
+    writer.join()
+    assert manager.published.data['scores'][-1] == score
+    assert manager.back.data['scores'][-1] == score
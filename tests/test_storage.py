@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+
+import yaml
+
+from benchmark import generate_data
+from data_manager import GistBackend, JournalBackend, SqliteBackend, apply_mutation, snapshot_data
+
+
+def score(player, machine, points, date='2024-05-01'):
+    return {'player_abbreviation': player, 'pinball_abbreviation': machine, 'points': points, 'date': date}
+
+
+MUTATIONS = [
+    {'op': 'add_score', 'score': score('P000', 'M00', 1000)},
+    {'op': 'add_scores', 'scores': [score('P001', 'M01', 2000), score('P001', 'M00', 500)]},
+    {'op': 'add_player', 'player': {'name': 'Neu', 'abbreviation': 'NEU', 'guest': True}},
+    {'op': 'add_score', 'score': score('NEU', 'M01', 3000)},
+    {'op': 'delete_score', 'score': score('P000', 'M00', 1000)},
+    {'op': 'delete_pinball', 'abbreviation': 'M02'},
+    {'op': 'delete_many', 'players': ['P002'], 'scores': [score('P001', 'M01', 2000), score('P001', 'M01', 1)]},
+    {'op': 'add_pinball', 'pinball': {'long_name': 'Neu', 'abbreviation': 'MNEU', 'room': '1'}},
+]
+
+
+def journal(path, initial, **kwargs):
+    backend = JournalBackend(str(path), **kwargs)
+    backend.save(initial)
+    assert backend.flush(5)
+    return backend
+
+
+def write_all(backend, data, mutations=MUTATIONS):
+    for mutation in mutations:
+        apply_mutation(data, mutation)
+        backend.append(mutation, data)
+    return data
+
+
+def test_journal_replays_mutations(tmp_path):
+    initial = generate_data(players=5, machines=4, scores=30)
+    backend = journal(tmp_path, initial)
+    data = write_all(backend, snapshot_data(initial))
+
+    reopened = JournalBackend(str(tmp_path))
+    assert reopened.load() == data
+    assert reopened.seq == len(MUTATIONS)
+
+
+def test_journal_compaction(tmp_path):
+    backend = JournalBackend(str(tmp_path), compact_every=3)
+    data = write_all(backend, generate_data(players=5, machines=4, scores=30))
+    assert backend.flush(5)
+    assert os.path.exists(tmp_path / JournalBackend.SNAPSHOT)
+    assert not os.path.exists(tmp_path / JournalBackend.ROTATED_JOURNAL)
+
+    reopened = JournalBackend(str(tmp_path), compact_every=3)
+    assert reopened.load() == data
+    assert reopened.seq == len(MUTATIONS)
+    # A compaction still running postpones the next one, but some records are in the snapshot
+    with open(tmp_path / JournalBackend.SNAPSHOT, encoding='utf-8') as f:
+        assert json.load(f)['seq'] >= 3
+    assert reopened.journal_records < len(MUTATIONS)
+
+
+def test_journal_ignores_torn_last_line(tmp_path):
+    initial = generate_data(players=5, machines=4, scores=30)
+    data = write_all(journal(tmp_path, initial), snapshot_data(initial), MUTATIONS[:3])
+    with open(tmp_path / JournalBackend.JOURNAL, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'seq': 4, 'mutation': MUTATIONS[3]})[:20])
+    assert JournalBackend(str(tmp_path)).load() == data
+
+
+def test_journal_finishes_interrupted_compaction(tmp_path):
+    initial = generate_data(players=5, machines=4, scores=30)
+    backend = journal(tmp_path, initial)
+    data = write_all(backend, snapshot_data(initial), MUTATIONS[:4])
+    backend._journal.close()
+    os.replace(tmp_path / JournalBackend.JOURNAL, tmp_path / JournalBackend.ROTATED_JOURNAL)
+
+    reopened = JournalBackend(str(tmp_path))
+    assert reopened.load() == data
+    assert not os.path.exists(tmp_path / JournalBackend.ROTATED_JOURNAL)
+    assert JournalBackend(str(tmp_path)).load() == data
+
+
+def test_sqlite_workers_catch_up(tmp_path):
+    path = str(tmp_path / 'aixplay.sqlite3')
+    initial = generate_data(players=5, machines=4, scores=30)
+    first = SqliteBackend(path)
+    first.save(initial)
+    second = SqliteBackend(path)
+    second_data = second.load()
+    assert second_data == initial
+
+    data = snapshot_data(initial)
+    reloads = []
+    with first.transaction(lambda mutations: None, reloads.append):
+        write_all(first, data)
+    assert not reloads
+    assert second.has_changes()
+
+    applied = []
+    second.catch_up(applied.extend, reloads.append)
+    assert applied == MUTATIONS
+    for mutation in applied:
+        apply_mutation(second_data, mutation)
+    assert second_data == data
+    assert not second.has_changes()
+    assert second.version() == first.version()
+    assert SqliteBackend(path).load() == data
+
+
+def test_sqlite_writer_applies_other_workers_first(tmp_path):
+    path = str(tmp_path / 'aixplay.sqlite3')
+    first = SqliteBackend(path)
+    first.save(generate_data(players=5, machines=4, scores=30))
+    second = SqliteBackend(path)
+    second.load()
+    with first.transaction(lambda mutations: None, lambda data: None):
+        first.append(MUTATIONS[0], None)
+
+    applied = []
+    with second.transaction(applied.extend, lambda data: None):
+        second.append(MUTATIONS[1], None)
+    assert applied == [MUTATIONS[0]]
+    assert second.version() == (first.epoch, 2)
+
+
+def test_sqlite_reloads_after_compaction(tmp_path):
+    path = str(tmp_path / 'aixplay.sqlite3')
+    first = SqliteBackend(path, compact_every=2)
+    first.save(generate_data(players=5, machines=4, scores=30))
+    second = SqliteBackend(path, compact_every=2)
+    second.load()
+
+    with first.transaction(lambda mutations: None, lambda data: None):
+        data = write_all(first, first.load())
+    reloads = []
+    second.catch_up(lambda mutations: None, reloads.append)
+    assert reloads == [data]
+
+
+def test_sqlite_rolls_back_failed_write(tmp_path):
+    path = str(tmp_path / 'aixplay.sqlite3')
+    backend = SqliteBackend(path)
+    initial = generate_data(players=5, machines=4, scores=30)
+    backend.save(initial)
+    reloads = []
+    try:
+        with backend.transaction(lambda mutations: None, reloads.append):
+            write_all(backend, snapshot_data(initial), MUTATIONS[:1])
+            raise RuntimeError('route failed')
+    except RuntimeError:
+        pass
+    assert reloads == [initial]
+    assert SqliteBackend(path).load() == initial
+
+
+class FakeGist:
+    """Stands in for the GitHub API of a GistBackend."""
+
+    def __init__(self, data, revision='r1'):
+        self.content = yaml.dump(data)
+        self.revision = revision
+        self.uploads = []
+
+    def fetch(self, etag=None):
+        if etag == self.revision:
+            return None
+        return self.content, self.revision, self.revision
+
+    def update(self, content):
+        self.uploads.append(content)
+        self.content = content
+        self.revision = f'r{len(self.uploads) + 1}'
+        return {'history': [{'version': self.revision}]}
+
+
+def gist_backend(gist, cache_path):
+    backend = GistBackend('id', 'token', 'aixplay.yaml', cache_path=cache_path)
+    backend.fetch_gist = gist.fetch
+    backend.update_gist = gist.update
+    backend.persister.delay = 0
+    return backend
+
+
+def test_gist_reconcile_replays_mutations_on_newer_gist(tmp_path):
+    cache_path = str(tmp_path / 'gist-cache.pickle')
+    stale = generate_data(players=5, machines=4, scores=30)
+    gist = FakeGist(stale)
+    gist_backend(gist, cache_path).load()
+
+    # Another instance uploaded meanwhile, this one restarts from its cache
+    newer = generate_data(players=5, machines=4, scores=40, seed=1)
+    gist.content, gist.revision = yaml.dump(newer), 'r9'
+    backend = gist_backend(gist, cache_path)
+    data = backend.load_cached()
+    assert data == stale
+    write_all(backend, data, MUTATIONS[:2])
+    assert not gist.uploads
+
+    reloaded = []
+    lock = threading.RLock()
+    assert backend.reconcile(lambda: lock, reloaded.append)
+    expected = snapshot_data(newer)
+    for mutation in MUTATIONS[:2]:
+        apply_mutation(expected, mutation)
+    assert reloaded == [expected]
+    assert backend.flush(5)
+    assert yaml.safe_load(gist.uploads[-1]) == expected
+    assert gist_backend(gist, cache_path).load_cached() == expected
+
+
+def test_gist_reconcile_unchanged(tmp_path):
+    cache_path = str(tmp_path / 'gist-cache.pickle')
+    data = generate_data(players=5, machines=4, scores=30)
+    gist = FakeGist(data)
+    gist_backend(gist, cache_path).load()
+
+    backend = gist_backend(gist, cache_path)
+    cached = backend.load_cached()
+    write_all(backend, cached, MUTATIONS[:1])
+    reloaded = []
+    assert not backend.reconcile(on_reload=reloaded.append)
+    assert not reloaded
+    assert backend.flush(5)
+    assert yaml.safe_load(gist.uploads[-1]) == cached
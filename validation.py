@@ -1,4 +1,187 @@
+import math
+import os
 
-def is_score_valid(new_score):
-    # Implement score validation logic
-    return True
+# What add_score does with an implausible score: 'off' ignores the check, 'flag' accepts
+# the score but reports the verdict, 'reject' refuses it unless the client insists (?force=1)
+SCORE_VALIDATION = os.environ.get('SCORE_VALIDATION', 'off')
+# Fewer scores than this on a machine are not enough to judge a new one
+MIN_SAMPLES = 5
+# Scores further away than this many standard deviations (on a log scale) are implausible
+Z_THRESHOLD = 3.0
+# Relative accuracy of the quantile sketch
+SKETCH_ACCURACY = 0.02
+
+
+class QuantileSketch:
+    """
+    Log-bucketed histogram (DDSketch style) for percentiles.
+
+    Every value falls into a bucket whose bounds are within `accuracy` of it, so
+    the number of buckets only depends on the range of the scores, not on how
+    many there are. Unlike most sketches it supports removing values again.
+    """
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}   # bucket index -> count, non-positive values share bucket None
+        self.count = 0
+
+    def _bucket(self, value):
+        if value <= 0:
+            return None
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def add(self, value):
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+
+    def remove(self, value):
+        bucket = self._bucket(value)
+        count = self.buckets.get(bucket, 0)
+        if not count:
+            return
+        if count == 1:
+            del self.buckets[bucket]
+        else:
+            self.buckets[bucket] = count - 1
+        self.count -= 1
+
+    def percentile(self, value):
+        """Share of values below `value` (values in the same bucket count half), 0..100."""
+        if not self.count:
+            return None
+        bucket = self._bucket(value)
+        below = same = 0
+        for index, count in self.buckets.items():
+            if index == bucket:
+                same += count
+            elif bucket is not None and (index is None or index < bucket):
+                below += count
+        return 100.0 * (below + same / 2) / self.count
+
+    def quantile(self, q):
+        """Approximate value at quantile `q` (0..1)."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets, key=lambda i: -math.inf if i is None else i):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 0 if index is None else 2 * self.gamma ** index / (self.gamma + 1)
+        return None
+
+
+class RunningStats:
+    """Count, mean and variance of log10(points) for one machine (Welford, with removal)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = QuantileSketch()
+
+    def add(self, points):
+        value = _log(points)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(points)
+
+    def remove(self, points):
+        value = _log(points)
+        if self.count <= 1:
+            self.__init__()
+            return
+        delta = value - self.mean
+        self.mean = (self.mean * self.count - value) / (self.count - 1)
+        self.count -= 1
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+        self.sketch.remove(points)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class ScoreStatistics:
+    """Running statistics per machine, updated on every insert and delete of a score."""
+
+    def __init__(self, scores=None):
+        self.machines = {}   # pinball_abbreviation -> RunningStats
+        if scores is not None:
+            self.rebuild(scores)
+
+    def rebuild(self, scores):
+        self.machines = {}
+        for score in scores:
+            self.add_score(score)
+
+    def add_score(self, score):
+        if not _is_number(score['points']):
+            return
+        stats = self.machines.get(score['pinball_abbreviation'])
+        if stats is None:
+            stats = self.machines[score['pinball_abbreviation']] = RunningStats()
+        stats.add(score['points'])
+
+    def remove_score(self, score):
+        stats = self.machines.get(score['pinball_abbreviation'])
+        if stats is None or not _is_number(score['points']):
+            return
+        stats.remove(score['points'])
+        if not stats.count:
+            del self.machines[score['pinball_abbreviation']]
+
+    def remove_machine(self, pinball_abbreviation):
+        self.machines.pop(pinball_abbreviation, None)
+
+    def check(self, pinball_abbreviation, points):
+        """
+        Plausibility verdict for a new score: its z-score against the machine's
+        scores (on a log scale, so an extra digit stands out) and its percentile.
+        Raises ValueError if `points` is not a finite number.
+        """
+        if not _is_number(points) or not math.isfinite(points):
+            raise ValueError(f"Invalid points '{points}', expected a number")
+        stats = self.machines.get(pinball_abbreviation)
+        verdict = {
+            'is_valid': True,
+            'samples': stats.count if stats else 0,
+            'z_score': None,
+            'percentile': None,
+            'median': None
+        }
+        if stats is None or stats.count < MIN_SAMPLES:
+            verdict['reason'] = 'Not enough data to validate'
+            return verdict
+
+        verdict['percentile'] = round(stats.sketch.percentile(points), 1)
+        verdict['median'] = round(stats.sketch.quantile(0.5))
+        if stats.stddev:
+            z_score = (_log(points) - stats.mean) / stats.stddev
+            verdict['z_score'] = round(z_score, 2)
+            if abs(z_score) > Z_THRESHOLD:
+                verdict['is_valid'] = False
+                verdict['reason'] = 'Score is unusually ' + ('high' if z_score > 0 else 'low') + ' for this machine'
+        return verdict
+
+
+def check_points(points):
+    """
+    Raises ValueError unless `points` is a whole number of at least 0, checked
+    before any score is stored whatever SCORE_VALIDATION says.
+    """
+    if isinstance(points, bool) or not isinstance(points, int) or points < 0:
+        raise ValueError(f"Invalid points '{points}', expected a whole number of at least 0")
+    return points
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _log(points):
+    return math.log10(points) if points > 0 else 0.0